@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from benchmarks.synthetic import iter_signal, generate_signal, synthetic_logbook, write_gt3x, write_model
+
+history_path = os.path.join(os.path.dirname(__file__), "history.jsonl")
+
+# Timings below this many seconds are too noisy to flag as regressions
+noise_floor_seconds = 0.05
+
+
+def machine_info():
+    return {"hostname": socket.gethostname(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def best_time(function, repeat):
+    # Best of repeat runs, and the result of the last one
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def check_equivalence(minutes=30, seed=0):
+    """
+    Compares the vectorized feature engine with the reference tsfresh path on
+    a float64 synthetic signal.
+    """
+    from utils.feature_extraction import extract_features_with_start_times, extract_features_with_start_times_tsfresh
+    try:
+        import tsfresh  # noqa: F401
+    except ImportError:
+        return {"skipped": "tsfresh is not installed"}
+
+    signal = generate_signal(1, seed=seed, nonwear_hours=None).slice(0, minutes * 60 * 30)
+    df = signal.to_dataframe()
+    df[["X", "Y", "Z", "vector_magnitude"]] = df[["X", "Y", "Z", "vector_magnitude"]].astype(np.float64)
+
+    features, start_times = extract_features_with_start_times(df)
+    reference, reference_start_times = extract_features_with_start_times_tsfresh(df)
+    reference = reference[features.columns].to_numpy(dtype=np.float64)
+    values = features.to_numpy(dtype=np.float64)
+
+    both_nan = np.isnan(values) & np.isnan(reference)
+    difference = np.where(both_nan, 0, np.abs(values - reference))
+    close = np.isclose(values, reference, rtol=1e-6, atol=1e-8) | both_nan
+    return {
+        "epochs": len(features),
+        "max_abs_diff": float(np.nanmax(difference)),
+        "mismatched_values": int((~close).sum()),
+        "same_start_times": list(start_times) == list(reference_start_times),
+        "passed": bool(close.all()) and list(start_times) == list(reference_start_times),
+    }
+
+
+def run_size(days, participants, repeat, folder, jobs):
+    """
+    Times each utils stage on one synthetic recording of the given length
+    and the whole pipeline on participants such recordings.
+    """
+    from utils.loader import load_raw_accel_file
+    from utils.nonwear_cleaner import trim_to_wear_times, detect_wear_times
+    from utils.feature_extraction import extract_features_with_start_times
+    from utils.summarizer import summarize_predictions
+    from utils.pipeline import load_outcome_model, run_pipeline
+    from utils.classifier import predict_labels
+
+    input_folder = os.path.join(folder, f"input_{days}d")
+    os.makedirs(input_folder, exist_ok=True)
+    studyids = [f"bench{i + 1:03d}" for i in range(participants)]
+    for i, studyid in enumerate(studyids):
+        write_gt3x(os.path.join(input_folder, studyid + ".gt3x"), iter_signal(days, seed=i))
+    logbook = synthetic_logbook(studyids, days)
+    logbook_path = os.path.join(folder, f"logbook_{days}d.csv")
+    logbook.to_csv(logbook_path, index=False)
+
+    results = {}
+
+    def record(name, seconds, samples=None, epochs=None):
+        results[name] = {"seconds": round(seconds, 4)}
+        if samples:
+            results[name]["samples"] = samples
+            results[name]["samples_per_second"] = round(samples / seconds, 1)
+        if epochs:
+            results[name]["epochs"] = epochs
+            results[name]["epochs_per_second"] = round(epochs / seconds, 1)
+        print(f"  {name:35s} {seconds:9.3f} s", flush=True)
+
+    file_path = os.path.join(input_folder, studyids[0] + ".gt3x")
+    seconds, signal = best_time(lambda: load_raw_accel_file(file_path, as_signal=True), repeat)
+    record("load_raw_accel_file", seconds, samples=len(signal))
+
+    wear_time_df = logbook[logbook["studyid"] == studyids[0]]
+    seconds, trimmed = best_time(lambda: trim_to_wear_times(signal, wear_time_df), repeat)
+    record("trim_to_wear_times", seconds, samples=len(signal))
+
+    seconds, _ = best_time(lambda: detect_wear_times([signal], studyids[0]), repeat)
+    record("detect_wear_times", seconds, samples=len(signal))
+
+    seconds, (features, start_times) = best_time(lambda: extract_features_with_start_times(trimmed), repeat)
+    record("extract_features_with_start_times", seconds, epochs=len(features))
+
+    seconds, (windows, _) = best_time(lambda: extract_features_with_start_times(trimmed, hop=1), repeat)
+    record("extract_features_with_start_times hop=1", seconds, epochs=len(windows))
+
+    outcome = "NVM_TPA_SED"
+    model, label_encoder = load_outcome_model(outcome)
+    seconds, predictions = best_time(lambda: predict_labels(model, features, start_times, label_encoder), repeat)
+    record("predict_labels", seconds, epochs=len(features))
+
+    seconds, _ = best_time(lambda: summarize_predictions(predictions.copy()), repeat)
+    record("summarize_predictions", seconds, epochs=len(predictions))
+
+    selectedData = {"input_folder": input_folder, "output_folder": os.path.join(folder, f"output_{days}d"),
+                    "outcome": outcome, "result_outputs": [], "non_wear_method": "Logbook", "logbook_file": logbook_path,
+                    "n_jobs": jobs, "cache_folder": None}
+    os.makedirs(selectedData["output_folder"], exist_ok=True)
+    start = time.perf_counter()
+    run_pipeline(selectedData, lambda percent, status: None)
+    record("run_pipeline", time.perf_counter() - start, epochs=len(features) * participants)
+
+    return results
+
+
+def use_throwaway_models(folder):
+    """
+    Points the pipeline at throwaway models written to folder when the
+    release models are not installed, so that prediction and the end-to-end
+    run are still timed. Pool workers inherit the environment variable.
+
+    Returns:
+        - Whether throwaway models are used.
+    """
+    from utils.config import outcome_models, model_folder_variable
+    from utils.pipeline import get_model_path
+
+    if all(os.path.exists(get_model_path(outcome)) for outcome in outcome_models):
+        return False
+
+    model_folder = os.path.join(folder, "models")
+    os.makedirs(model_folder, exist_ok=True)
+    for model_path, classes in outcome_models.values():
+        write_model(os.path.join(model_folder, os.path.basename(model_path)), classes)
+    os.environ[model_folder_variable] = model_folder
+    return True
+
+
+def find_regressions(result, history, threshold):
+    # Compares with the last recorded run on the same machine
+    previous = [entry for entry in history if entry.get("machine", {}).get("hostname") == result["machine"]["hostname"]]
+    if not previous:
+        return []
+
+    regressions = []
+    for size, stages in result["sizes"].items():
+        for name, timing in stages.items():
+            before = previous[-1].get("sizes", {}).get(size, {}).get(name)
+            if before and timing["seconds"] > noise_floor_seconds and timing["seconds"] > before["seconds"] * (1 + threshold):
+                regressions.append(f"{name} ({size} days): {before['seconds']:.3f} s -> {timing['seconds']:.3f} s")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times the pipeline on synthetic multi-day recordings and checks the feature engine against tsfresh.")
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7], help="Recording lengths to benchmark (default 1 7).")
+    parser.add_argument("--participants", type=int, default=2, help="Files in the end-to-end run (default 2).")
+    parser.add_argument("--jobs", type=int, default=1, help="Files processed at once in the end-to-end run (default 1).")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per function; the best time is kept (default 1).")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown versus the last run on this machine reported as a regression (default 0.2 = 20%%).")
+    parser.add_argument("--no-record", action="store_true", help="Do not append the results to benchmarks/history.jsonl.")
+    args = parser.parse_args(argv)
+
+    result = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(), "machine": machine_info(), "sizes": {}}
+
+    print("Feature equivalence with tsfresh...", flush=True)
+    result["equivalence"] = check_equivalence()
+    print("  " + json.dumps(result["equivalence"]), flush=True)
+
+    with tempfile.TemporaryDirectory() as folder:
+        result["throwaway_models"] = use_throwaway_models(folder)
+        if result["throwaway_models"]:
+            print("Model files not found, timing prediction with throwaway models", flush=True)
+        for days in args.days:
+            print(f"{days} day(s):", flush=True)
+            result["sizes"][str(days)] = run_size(days, args.participants, args.repeat, folder, args.jobs)
+
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            history = [json.loads(line) for line in f if line.strip()]
+    regressions = find_regressions(result, history, args.threshold)
+
+    if not args.no_record:
+        with open(history_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    for regression in regressions:
+        print("Regression: " + regression, flush=True)
+    if not result["equivalence"].get("passed", True):
+        print("Feature values differ from tsfresh", flush=True)
+        return 1
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
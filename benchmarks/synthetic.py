@@ -0,0 +1,140 @@
+import zipfile
+import numpy as np
+import pandas as pd
+from utils.raw_signal import RawSignal
+
+# Standard deviation (g) of the movement in each activity state
+activity_levels = {"sedentary": 0.02, "light": 0.15, "active": 0.5}
+
+default_activity_mix = {"sedentary": 0.5, "light": 0.3, "active": 0.2}
+
+
+def iter_signal(days=1, hz=30, start="2025-01-06 00:00:00", activity_mix=None, nonwear_hours=(20, 7), seed=0):
+    """
+    Yields a synthetic tri-axial recording one day at a time as RawSignals.
+
+    Parameters:
+        - days: Length of the recording in days.
+        - hz: Sampling frequency.
+        - start: Start time, on a whole second.
+        - activity_mix: Share of minutes spent in each state of activity_levels
+          while the device is worn.
+        - nonwear_hours: (off, on) hours of the day between which the device
+          lies still every night, e.g. (20, 7) for 20:00 to 07:00. None for no nonwear.
+        - seed: Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    activity_mix = activity_mix or default_activity_mix
+    states = list(activity_mix)
+    shares = np.array([activity_mix[state] for state in states], dtype=float)
+    levels = np.array([activity_levels[state] for state in states])
+    start = np.datetime64(pd.Timestamp(start), "ns")
+    samples_per_minute = 60 * hz
+
+    for day in range(days):
+        day_start = start + np.timedelta64(day * 86400, "s")
+        minutes = rng.choice(len(states), size=1440, p=shares / shares.sum())
+        sd = np.repeat(levels[minutes], samples_per_minute)[:, None]
+
+        # Slow orientation changes per minute plus movement around them
+        orientation = np.repeat(rng.normal(0, 0.3, (1440, 3)) + [0, 0, 1], samples_per_minute, axis=0)
+        xyz = orientation + rng.normal(0, 1, (1440 * samples_per_minute, 3)) * sd
+
+        if nonwear_hours is not None:
+            hour = (pd.Timestamp(day_start).hour + np.arange(1440 * samples_per_minute) / (3600 * hz)) % 24
+            off, on = nonwear_hours
+            still = (hour >= off) | (hour < on) if off > on else (hour >= off) & (hour < on)
+            xyz[still] = [0, 0, 1] + rng.normal(0, 0.002, (still.sum(), 3))
+
+        values = np.empty((len(xyz), 4), dtype=np.float32)
+        values[:, :3] = xyz
+        values[:, 3] = np.sqrt((values[:, :3]**2).sum(axis=1))
+        yield RawSignal(values, day_start, hz)
+
+
+def generate_signal(days=1, **kwargs):
+    """
+    Returns a synthetic recording as a single RawSignal. See iter_signal for the parameters.
+    """
+    return RawSignal.concatenate(list(iter_signal(days, **kwargs)))
+
+
+def synthetic_logbook(studyids, days=1, start="2025-01-06 00:00:00", nonwear_hours=(20, 7)):
+    """
+    Returns logbook rows (studyid, WearTimeStart, WearTimeEnd) matching the
+    worn hours of iter_signal, one row per participant and day.
+    """
+    off, on = nonwear_hours
+    rows = []
+    for studyid in studyids:
+        for day in pd.date_range(pd.Timestamp(start).normalize(), periods=days, freq="D"):
+            rows.append({"studyid": studyid,
+                         "WearTimeStart": day + pd.Timedelta(hours=on),
+                         "WearTimeEnd": day + pd.Timedelta(hours=off) - pd.Timedelta(seconds=1)})
+
+    return pd.DataFrame(rows)
+
+
+def _checksum(separator, record_type, timestamps, size, payload):
+    # ActiGraph log record checksum: one's complement of the XOR of all header and payload bytes
+    checksum = separator ^ record_type ^ size & 0xFF ^ size >> 8
+    checksum ^= np.bitwise_xor.reduce(timestamps.view(np.uint8).reshape(-1, 4), axis=1)
+    checksum ^= np.bitwise_xor.reduce(payload, axis=1)
+    return ~checksum & 0xFF
+
+
+def write_gt3x(path, signals, acceleration_scale=256.0):
+    """
+    Writes RawSignal blocks as a .gt3x file readable by pygt3x.
+
+    Each second becomes one ACTIVITY2 log record of raw int16 counts. The
+    blocks must be gap-free, start on whole seconds and hold whole seconds.
+    """
+    if isinstance(signals, RawSignal):
+        signals = [signals]
+
+    hz = None
+    first_second = last_second = None
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as gt3x:
+        with gt3x.open("log.bin", "w") as log:
+            for signal in signals:
+                hz = signal.hz
+                seconds = len(signal) // hz
+                counts = np.round(signal.values[:seconds * hz, :3] * acceleration_scale).astype("<i2")
+                payload = counts.reshape(seconds, hz * 3).view(np.uint8).reshape(seconds, -1)
+
+                timestamps = (signal.timestamps(np.arange(seconds) * hz).astype("datetime64[s]").astype(np.int64)).astype("<u4")
+                if seconds:
+                    first_second = int(timestamps[0]) if first_second is None else first_second
+                    last_second = int(timestamps[-1]) + 1
+                record = np.zeros(seconds, dtype=[("separator", "u1"), ("type", "u1"), ("timestamp", "<u4"), ("size", "<u2"),
+                                                  ("payload", "u1", payload.shape[1]), ("checksum", "u1")])
+                record["separator"] = 0x1E
+                record["type"] = 26  # ACTIVITY2
+                record["timestamp"] = timestamps
+                record["size"] = payload.shape[1]
+                record["payload"] = payload
+                record["checksum"] = _checksum(0x1E, 26, timestamps, payload.shape[1], payload)
+                log.write(record.tobytes())
+
+        # Dates in info.txt are .NET ticks (100 ns since 0001-01-01)
+        start_date, last_sample_time = [0 if second is None else (second + 62135596800) * 10**7 for second in (first_second, last_second)]
+        gt3x.writestr("info.txt", f"Serial Number: SYNTHETIC\nSample Rate: {hz}\nAcceleration Scale: {acceleration_scale}\n"
+                                  f"Acceleration Min: -8.0\nAcceleration Max: 8.0\nStart Date: {start_date}\nStop Date: {last_sample_time}\n"
+                                  f"Last Sample Time: {last_sample_time}\nDownload Date: 0\nBattery Voltage: 4.0\n")
+
+
+def write_model(path, classes, seed=0, n_estimators=5):
+    """
+    Writes a throwaway XGBoost model with the feature names of the real
+    models, for timing prediction when the release models are not installed.
+    Its predictions are meaningless.
+    """
+    import xgboost as xgb
+    from utils.feature_extraction import extract_features_with_start_times
+
+    columns = extract_features_with_start_times(generate_signal(1, seed=seed, nonwear_hours=None).slice(0, 60 * 30))[0].columns
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.normal(size=(50 * len(classes), len(columns))), columns=columns)
+    labels = np.arange(len(features)) % len(classes)
+    xgb.XGBClassifier(n_estimators=n_estimators, max_depth=3).fit(features, labels).save_model(path)
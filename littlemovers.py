@@ -0,0 +1,142 @@
+import sys
+import os
+import signal
+import argparse
+import threading
+import multiprocessing
+from utils.config import outcome_models, default_cache_folder, default_signal_cache_folder, bout_minutes, bout_tolerance_minutes, bout_min_share
+from utils.writers import output_formats
+
+# Exit codes. Invalid arguments exit with 2, like any argparse program.
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_CANCELLED = 130
+
+nonwear_methods = {"logbook": "Logbook", "accelerometer": "Accelerometer", "none": "None"}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="littlemovers", description="Little Movers Activity Analysis without the graphical interface.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Process every .gt3x file in the input folder.")
+    run.add_argument("--input", required=True, help="Folder with the .gt3x files.")
+    run.add_argument("--output", required=True, help="Folder where the output files are saved. Created if missing.")
+    run.add_argument("--outcome", required=True, nargs="+", choices=sorted(outcome_models), help="Model outcomes to assess. Give both to score both models with features extracted once.")
+    run.add_argument("--nonwear", required=True, choices=sorted(nonwear_methods), help="Nonwear removal method.")
+    run.add_argument("--logbook", help="Logbook .csv file with headers studyid,WearTimeStart,WearTimeEnd (required with --nonwear logbook).")
+    run.add_argument("--jobs", type=int, default=1, help="Number of files processed at once (default 1).")
+    run.add_argument("--feature-jobs", type=int, help="Threads extracting features within a file (default: the cores left over per file).")
+    run.add_argument("--feature-cache", nargs="?", const=default_cache_folder, metavar="FOLDER",
+                     help="Keep the extracted features (up to 5 GB) so that later runs of the same files skip feature extraction (default folder %(const)s).")
+    # Options of the feature cache from when it was on by default
+    run.add_argument("--cache-folder", dest="feature_cache", help=argparse.SUPPRESS)
+    run.add_argument("--no-cache", action="store_true", help=argparse.SUPPRESS)
+    run.add_argument("--signal-cache", nargs="?", const=default_signal_cache_folder, metavar="FOLDER",
+                     help="Keep the decoded recordings (about 300 MB per week of data) so that later runs skip GT3X decoding (default folder %(const)s).")
+    run.add_argument("--format", default="csv", choices=sorted(output_formats), help="Format of the per-file predictions and trimmed data (default %(default)s). Parquet and Feather need pyarrow.")
+    run.add_argument("--no-trimmed-data", action="store_true", help="Do not save the trimmed raw data.")
+    run.add_argument("--no-predictions", action="store_true", help="Do not save the per-file predictions, only the summaries.")
+    run.add_argument("--slim-predictions", action="store_true", help="Save time, prediction and class probabilities instead of the features.")
+    run.add_argument("--hourly", action="store_true", help="Also write by_hour_by_participants.csv.")
+    run.add_argument("--weekday-weekend", action="store_true", help="Also write by_weekday_weekend_by_participants.csv.")
+    run.add_argument("--bouts", action="store_true", help="Also write bouts_by_day_by_participants.csv with the daily activity bouts, sedentary breaks and transitions.")
+    run.add_argument("--bout-minutes", type=float, default=bout_minutes, help="Shortest bout in minutes (default %(default)s).")
+    run.add_argument("--bout-tolerance", type=float, default=bout_tolerance_minutes, help="Longest interruption within a bout in minutes (default %(default)s).")
+    run.add_argument("--bout-min-share", type=float, default=bout_min_share,
+                     help="Share of a bout's epochs that must be of the bout's type, between 0.5 and 1 (default %(default)s).")
+    run.add_argument("--hop", type=int, metavar="SECONDS", help="Score overlapping 5-second windows starting every SECONDS (1 to 5) instead of consecutive epochs, for a finer activity timeline.")
+    run.add_argument("--incremental", action="store_true", help="Only process files that are new or changed since the last run into the output folder.")
+    run.add_argument("--progress-interval", type=float, default=10, metavar="SECONDS",
+                     help="Seconds between progress lines with the epochs per second and time left while a file is processed (default %(default)s).")
+    run.add_argument("--restart", action="store_true", help="Process every file again instead of resuming a run into the output folder that was stopped.")
+
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.input):
+        parser.error("input folder does not exist: " + args.input)
+    if args.nonwear == "logbook" and not (args.logbook and os.path.isfile(args.logbook)):
+        parser.error("--nonwear logbook needs an existing --logbook file")
+    if args.jobs < 1 or (args.feature_jobs is not None and args.feature_jobs < 1):
+        parser.error("--jobs and --feature-jobs must be at least 1")
+    if args.hop is not None and not 1 <= args.hop <= 5:
+        parser.error("--hop must be between 1 and 5 seconds")
+    if args.bout_minutes <= 0 or args.bout_tolerance < 0:
+        parser.error("--bout-minutes must be positive and --bout-tolerance at least 0")
+    if not 0.5 < args.bout_min_share <= 1:
+        parser.error("--bout-min-share must be above 0.5 and at most 1")
+
+    return args
+
+
+def selected_data_from_args(args):
+    # Same selections as ToddlerAccelApp.getSelectedData
+    return {
+        "input_folder": args.input,
+        "output_folder": args.output,
+        "outcome": args.outcome[0] if len(args.outcome) == 1 else list(dict.fromkeys(args.outcome)),
+        "result_outputs": [],
+        "non_wear_method": nonwear_methods[args.nonwear],
+        "logbook_file": args.logbook if args.nonwear == "logbook" else None,
+        "n_jobs": args.jobs,
+        "feature_jobs": args.feature_jobs,
+        "cache_folder": None if args.no_cache else args.feature_cache,
+        "signal_cache_folder": args.signal_cache,
+        "incremental": args.incremental,
+        "resume": not args.restart,
+        "progress_interval": args.progress_interval,
+        "hop_seconds": args.hop,
+        "output_format": args.format,
+        "save_trimmed_data": not args.no_trimmed_data,
+        "save_predictions": not args.no_predictions,
+        "slim_predictions": args.slim_predictions,
+        "hourly_summary": args.hourly,
+        "weekday_summary": args.weekday_weekend,
+        "bout_summary": args.bouts,
+        "bout_minutes": args.bout_minutes,
+        "bout_tolerance_minutes": args.bout_tolerance,
+        "bout_min_share": args.bout_min_share,
+    }
+
+
+def print_progress(percent, status):
+    print(f"[{percent:3d}%] {status}", flush=True)
+
+
+def stop_on_signals(stop):
+    # The first Ctrl+C or SIGTERM stops the run cleanly, a second Ctrl+C interrupts it
+    def request_stop(signum, frame):
+        if stop.is_set() and signum == signal.SIGINT:
+            raise KeyboardInterrupt
+        stop.set()
+        print("Stopping after the current block of data (press Ctrl+C again to interrupt)...", file=sys.stderr, flush=True)
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    os.makedirs(args.output, exist_ok=True)
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        stop_on_signals(stop)
+
+    try:
+        # Imported after the arguments are checked so that --help and usage errors return immediately
+        from utils.pipeline import run_pipeline
+        if not run_pipeline(selected_data_from_args(args), print_progress, should_stop=stop.is_set):
+            return EXIT_CANCELLED if stop.is_set() else EXIT_FAILED
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr, flush=True)
+        return EXIT_CANCELLED
+    except Exception as error:
+        print(f"Error: {type(error).__name__}: {error}", file=sys.stderr, flush=True)
+        return EXIT_FAILED
+
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    multiprocessing.set_start_method('spawn', force=True)
+    sys.exit(main())
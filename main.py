@@ -1,15 +1,15 @@
+import time
+start_time = time.time()
 import sys
+import threading
+import importlib
 from PyQt5 import QtCore
-from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QLineEdit, QPushButton, QRadioButton, QCheckBox, QFileDialog, QProgressBar, QButtonGroup, QGridLayout, QMessageBox, QToolTip, QHBoxLayout, QVBoxLayout
+from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QLineEdit, QPushButton, QRadioButton, QCheckBox, QFileDialog, QProgressBar, QButtonGroup, QGridLayout, QMessageBox, QToolTip, QHBoxLayout, QVBoxLayout, QSpinBox, QComboBox
 from PyQt5.QtGui import QMovie
 from PyQt5.QtCore import QSize, Qt
 import os
-from utils.loader import load_raw_accel_file
-from utils.feature_extraction import extract_features_with_start_times
-from utils.classifier import load_xgboost_classifier, predict, get_label_encoder
-from utils.summarizer import summarize_predictions, merge_summary_files
-from utils.nonwear_cleaner import process_nonwear_times
-import pandas as pd
+from utils.config import default_cache_folder, default_signal_cache_folder, bout_minutes, bout_tolerance_minutes, bout_min_share, startup_log_file
+from utils.profiler import process_start_time, append_log
 from os import path
 import multiprocessing
 
@@ -50,22 +50,20 @@ class ToddlerAccelApp(QWidget):
         output_button.clicked.connect(self.browseOutputFolder)
 
         # Outcome assessment options
-        outcome_label = QLabel("Which outcomes do you want to assess?")
-        self.total_physical_activity_rb = QRadioButton("Non-volitional Movement, Sedentary Time, Total Physical Activity")
-        self.light_moderate_activity_rb = QRadioButton("Non-volitional Movement, Sedentary Time, Light Physical Activity, Moderate-To-Vigorous Physical Activity")
-       
-        outcome_group = QButtonGroup(self)
-        outcome_group.addButton(self.total_physical_activity_rb)
-        outcome_group.addButton(self.light_moderate_activity_rb)
+        outcome_label = QLabel("Which outcomes do you want to assess? (Select both to score both models in one run)")
+        self.total_physical_activity_checkbox = QCheckBox("Non-volitional Movement, Sedentary Time, Total Physical Activity")
+        self.light_moderate_activity_checkbox = QCheckBox("Non-volitional Movement, Sedentary Time, Light Physical Activity, Moderate-To-Vigorous Physical Activity")
         
 
         # Non-wear removal method
         non_wear_label = QLabel("Which method of nonwear removal would you like to use?")
         self.logbook_diary_rb = QRadioButton("Logbook/Diary")
+        self.accelerometer_rb = QRadioButton("Automatic (detected from the accelerometer signal)")
         self.none_rb = QRadioButton("None")
 
         non_wear_group = QButtonGroup(self)
         non_wear_group.addButton(self.logbook_diary_rb)
+        non_wear_group.addButton(self.accelerometer_rb)
         non_wear_group.addButton(self.none_rb)
 
         self.logbook_diary_rb.toggled.connect(self.toggleLogbookFileVisibility)
@@ -87,10 +85,58 @@ class ToddlerAccelApp(QWidget):
 
         self.logbook_widgets = (logbook_label, self.logbook_line_edit, logbook_button, logbook_info)
 
+        # Number of participants processed at once
+        jobs_info = QLabel("ℹ️")
+        jobs_info.setToolTip("Number of files processed at the same time. Each file needs its own share of memory, so increase this only on computers with several cores and enough RAM.")
+        jobs_info.mousePressEvent = lambda event: QToolTip.showText(event.globalPos(), jobs_info.toolTip())
+        jobs_label = QLabel("Files at once:")
+        self.jobs_spin_box = QSpinBox()
+        self.jobs_spin_box.setRange(1, os.cpu_count() or 1)
+        self.jobs_spin_box.setValue(1)
+
+        # Feature cache
+        cache_info = QLabel("ℹ️")
+        cache_info.setToolTip("Saves the extracted features so that re-running the same files (e.g. with the other outcome model) skips feature extraction. Up to 5 GB are kept in " + default_cache_folder + ".")
+        cache_info.mousePressEvent = lambda event: QToolTip.showText(event.globalPos(), cache_info.toolTip())
+        self.cache_checkbox = QCheckBox("Reuse features from previous runs")
+        self.cache_checkbox.setChecked(True)
+        self.signal_cache_checkbox = QCheckBox("Keep decoded raw data so re-runs skip reading the .gt3x files (uses about 300 MB per week of data)")
+        self.signal_cache_checkbox.setToolTip("Decoded recordings are kept in " + default_signal_cache_folder + " (up to 20 GB) and read back directly by later runs.")
+
+        # Incremental runs
+        incremental_info = QLabel("ℹ️")
+        incremental_info.setToolTip("Skips files that were already processed into this output folder with the same settings and logbook rows. New or changed files are processed and their rows in the summary files are replaced.")
+        incremental_info.mousePressEvent = lambda event: QToolTip.showText(event.globalPos(), incremental_info.toolTip())
+        self.incremental_checkbox = QCheckBox("Only process new or changed files")
+
+        # Per-file output format
+        format_info = QLabel("ℹ️")
+        format_info.setToolTip("Format of the per-file predictions and trimmed data files. Parquet and Feather files are compressed and much smaller and faster to write than CSV. The summary files are always CSV.")
+        format_info.mousePressEvent = lambda event: QToolTip.showText(event.globalPos(), format_info.toolTip())
+        format_label = QLabel("File format:")
+        self.format_combo_box = QComboBox()
+        self.format_combo_box.addItem("CSV", "csv")
+        self.format_combo_box.addItem("Parquet", "parquet")
+        self.format_combo_box.addItem("Feather", "feather")
+        self.trimmed_data_checkbox = QCheckBox("Save trimmed raw data")
+        self.trimmed_data_checkbox.setChecked(True)
+        self.features_checkbox = QCheckBox("Save features in predictions files (otherwise time, prediction and probabilities only)")
+        self.features_checkbox.setChecked(True)
+        self.breakdowns_checkbox = QCheckBox("Also summarize by hour and by weekday/weekend")
+        self.bouts_checkbox = QCheckBox("Also summarize activity bouts, sedentary breaks and transitions by day")
+        self.bouts_checkbox.setToolTip(f"Bouts last at least {bout_minutes} minutes and may include interruptions of up to {bout_tolerance_minutes} minutes, "
+                                       f"with at least {bout_min_share:.0%} of their time in the bout's activity.")
+
         # Run models button
         run_models_button = QPushButton("Run models")
         run_models_button.clicked.connect(self.runModels)
 
+        # Cancel button, shown while running
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setToolTip("Stops the run within a few seconds. Files that were already saved are kept, and running again with the same settings resumes at the first unfinished file.")
+        self.cancel_button.clicked.connect(self.cancelRun)
+        self.cancel_button.setVisible(False)
+
         # Status label
         self.status_label = QLabel()
         self.status_label.setVisible(False)
@@ -131,11 +177,12 @@ class ToddlerAccelApp(QWidget):
         main_layout.addWidget(output_button, 2, 3)
 
         main_layout.addWidget(outcome_label, 3, 0, 1, 4)
-        main_layout.addWidget(self.total_physical_activity_rb, 4, 0, 1, 4)
-        main_layout.addWidget(self.light_moderate_activity_rb, 5, 0, 1, 4)
+        main_layout.addWidget(self.total_physical_activity_checkbox, 4, 0, 1, 4)
+        main_layout.addWidget(self.light_moderate_activity_checkbox, 5, 0, 1, 4)
   
         main_layout.addWidget(non_wear_label, 11, 0, 1, 4)
         main_layout.addWidget(self.logbook_diary_rb, 12, 0, 1, 4)
+        main_layout.addWidget(self.accelerometer_rb, 14, 0, 1, 4)
         main_layout.addWidget(self.none_rb, 16, 0, 1, 4)
 
         main_layout.addWidget(logbook_info, 17, 0)
@@ -143,10 +190,30 @@ class ToddlerAccelApp(QWidget):
         main_layout.addWidget(self.logbook_line_edit, 17, 2)
         main_layout.addWidget(logbook_button, 17, 3)
 
-        main_layout.addWidget(self.running_gif_label, 18, 0, 1, 4)
-        main_layout.addWidget(self.status_label, 19, 0, 1, 4)
-        main_layout.addWidget(self.progress_bar, 20, 0, 1, 4)
-        main_layout.addWidget(run_models_button, 21, 3)
+        main_layout.addWidget(jobs_info, 18, 0)
+        main_layout.addWidget(jobs_label, 18, 1)
+        main_layout.addWidget(self.jobs_spin_box, 18, 2)
+
+        main_layout.addWidget(cache_info, 19, 0)
+        main_layout.addWidget(self.cache_checkbox, 19, 1, 1, 3)
+        main_layout.addWidget(self.signal_cache_checkbox, 20, 1, 1, 3)
+
+        main_layout.addWidget(incremental_info, 21, 0)
+        main_layout.addWidget(self.incremental_checkbox, 21, 1, 1, 3)
+
+        main_layout.addWidget(format_info, 22, 0)
+        main_layout.addWidget(format_label, 22, 1)
+        main_layout.addWidget(self.format_combo_box, 22, 2)
+        main_layout.addWidget(self.trimmed_data_checkbox, 23, 1, 1, 3)
+        main_layout.addWidget(self.features_checkbox, 24, 1, 1, 3)
+        main_layout.addWidget(self.breakdowns_checkbox, 25, 1, 1, 3)
+        main_layout.addWidget(self.bouts_checkbox, 26, 1, 1, 3)
+
+        main_layout.addWidget(self.running_gif_label, 27, 0, 1, 4)
+        main_layout.addWidget(self.status_label, 28, 0, 1, 4)
+        main_layout.addWidget(self.progress_bar, 29, 0, 1, 4)
+        main_layout.addWidget(self.cancel_button, 30, 2)
+        main_layout.addWidget(run_models_button, 30, 3)
 
         # Set layout
         container_layout = QVBoxLayout()
@@ -184,16 +251,31 @@ class ToddlerAccelApp(QWidget):
             "outcome": None,
             "result_outputs": [],
             "non_wear_method": None,
-            "logbook_file": self.logbook_line_edit.text() if self.logbook_diary_rb.isChecked() else None
+            "logbook_file": self.logbook_line_edit.text() if self.logbook_diary_rb.isChecked() else None,
+            "n_jobs": self.jobs_spin_box.value(),
+            "cache_folder": default_cache_folder if self.cache_checkbox.isChecked() else None,
+            "signal_cache_folder": default_signal_cache_folder if self.signal_cache_checkbox.isChecked() else None,
+            "incremental": self.incremental_checkbox.isChecked(),
+            "output_format": self.format_combo_box.currentData(),
+            "save_trimmed_data": self.trimmed_data_checkbox.isChecked(),
+            "slim_predictions": not self.features_checkbox.isChecked(),
+            "hourly_summary": self.breakdowns_checkbox.isChecked(),
+            "weekday_summary": self.breakdowns_checkbox.isChecked(),
+            "bout_summary": self.bouts_checkbox.isChecked()
         }
 
-        if self.total_physical_activity_rb.isChecked():
-            selected_data["outcome"] = "NVM_TPA_SED"
-        elif self.light_moderate_activity_rb.isChecked():
-            selected_data["outcome"] = "NVM_LPA_MVPA_SED"
+        outcomes = []
+        if self.total_physical_activity_checkbox.isChecked():
+            outcomes.append("NVM_TPA_SED")
+        if self.light_moderate_activity_checkbox.isChecked():
+            outcomes.append("NVM_LPA_MVPA_SED")
+        if outcomes:
+            selected_data["outcome"] = outcomes[0] if len(outcomes) == 1 else outcomes
 
         if self.logbook_diary_rb.isChecked():
             selected_data["non_wear_method"] = "Logbook"
+        elif self.accelerometer_rb.isChecked():
+            selected_data["non_wear_method"] = "Accelerometer"
         elif self.none_rb.isChecked():
             selected_data["non_wear_method"] = "None"
 
@@ -209,6 +291,8 @@ class ToddlerAccelApp(QWidget):
         self.status_label.setVisible(True)
         self.running_gif_label.movie().start()
         self.progress_bar.setVisible(True)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setVisible(True)
 
         multiprocessing.freeze_support()
 
@@ -221,6 +305,11 @@ class ToddlerAccelApp(QWidget):
         self.thread.start()
 
 
+    def cancelRun(self):
+        self.worker.stop()
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText("Cancelling...")
+
     def onPipelineProgressed(self, count, status):
         print("Progress update", count)
         self.progress_bar.setValue(count)
@@ -229,11 +318,12 @@ class ToddlerAccelApp(QWidget):
     def onPipelineFinished(self):
         self.running_gif_label.setVisible(False)
         self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
 
     def areAllSelectionsMade(self):
         if (self.input_line_edit.text() and self.output_line_edit.text() and
-            (self.total_physical_activity_rb.isChecked() or self.light_moderate_activity_rb.isChecked()) and
-            (self.logbook_diary_rb.isChecked() or self.none_rb.isChecked())):
+            (self.total_physical_activity_checkbox.isChecked() or self.light_moderate_activity_checkbox.isChecked()) and
+            (self.logbook_diary_rb.isChecked() or self.accelerometer_rb.isChecked() or self.none_rb.isChecked())):
             return True
         return False
     
@@ -244,78 +334,40 @@ class Worker(QtCore.QObject):
 
     def __init__(self, selectedData):
         super().__init__()
-        self._stopped = True
+        self._stopped = False
         self.selectedData = selectedData
 
     def run(self):
-        self.progressChanged.emit(0, "Loading the model...")
-        
-        if self.selectedData["outcome"] == "NVM_TPA_SED" :
-            model_path = get_relative_path("models/NVM-0_SED-1_TPA-2_5sIntPos.json")
-            label_classes = ['NVM', 'SED', 'TPA']
-        elif self.selectedData["outcome"] == "NVM_LPA_MVPA_SED" :
-            model_path = get_relative_path("models/NVM-0_SED-1_LPA-2_MVPA-3_5sIntPos.json")
-            label_classes = ['NVM', 'SED', 'LPA', 'MVPA']
-        else:
-            self.progressChanged.emit(100, "Error: No model selected!")
-            return  # Stop execution if no selection is made
-
-
-        model = load_xgboost_classifier(model_path)
-        label_encoder = get_label_encoder(label_classes)
-        self.progressChanged.emit(100, "Model loaded successfully!")
-
-        gt3x_folder = self.selectedData['input_folder']
-        files = os.listdir(gt3x_folder)
-        nonwear_method = self.selectedData['non_wear_method']
-        logbook_file = self.selectedData['logbook_file']
-        output_folder = self.selectedData['output_folder']
-
+        # Loads the scientific stack here unless the background preload already has
+        from utils.pipeline import run_pipeline
+        run_pipeline(self.selectedData, self.progressChanged.emit, should_stop=lambda: self._stopped)
 
-
-        summary_results = pd.DataFrame()
-
-        for idx, filename in enumerate(files):
-             file_path = gt3x_folder + "/" + filename
-             if os.path.isfile(file_path) and filename.endswith(".gt3x"):
-                self.progressChanged.emit(round((idx)/len(files)*100), "Removing nonwear for " + filename + "...")
-                data = load_raw_accel_file(file_path)
-                
-                studyid = os.path.splitext(filename)[0]
-                
-                daily_summary, trimmed_data = process_nonwear_times(data, nonwear_method, logbook_file, output_folder, studyid)
-                
-                self.progressChanged.emit(round((idx)/len(files)*100), "Nonwear removed for  " + filename)
-
-                self.progressChanged.emit(round((idx)/len(files)*100), "Extracting features for " + filename + "...")
-                features, start_times = extract_features_with_start_times(trimmed_data, epoch=5, hz=30)
-
-                self.progressChanged.emit(round((idx)/len(files)*100), "Features extracted for " + filename)
-
-                predictions = predict(model, features, start_times, label_encoder)
-                predictions.to_csv(os.path.join(self.selectedData['output_folder'], filename + "_predictions.csv"))
-
-                self.progressChanged.emit(round((idx+1.0)/len(files)*100), "File " + filename + " successfully predicted!")
-
-                summary = summarize_predictions(predictions, epoch=5)
-                summary['studyid'] = studyid
-                summary_results = pd.concat([summary_results, summary], axis=0)
-
-                # Save the summary results to CSV after each file
-                summary_results.to_csv(os.path.join(self.selectedData['output_folder'], "by_day_by_participants.csv"), mode='a', header=not os.path.exists(os.path.join(self.selectedData['output_folder'], "by_day_by_participants.csv")))
-                summary_results = pd.DataFrame()  
-                merge_summary_files(self.selectedData['output_folder'])
-
-        self.progressChanged.emit(100, "Complete!")
         self._stopped = True
         self.finished.emit()
 
     def stop(self):
         self._stopped = True
 
+def preload_pipeline(startup_seconds):
+    # pandas, pygt3x, xgboost and scikit-learn take seconds to import, so they are
+    # loaded in the background once the window is visible instead of before it.
+    # The timings go to a log file, as the packaged app has no console.
+    def load():
+        preload_start = time.perf_counter()
+        importlib.import_module("utils.pipeline")
+        append_log(startup_log_file, {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "frozen": getattr(sys, "frozen", False),
+                                      "startup_seconds": round(startup_seconds, 3),
+                                      "preload_seconds": round(time.perf_counter() - preload_start, 3)})
+
+    threading.Thread(target=load, daemon=True).start()
+
+
 def main():
     app = QApplication(sys.argv)
     ex = ToddlerAccelApp()
+    # From process creation when available, so that interpreter start-up is included
+    startup_seconds = time.time() - (process_start_time() or start_time)
+    QtCore.QTimer.singleShot(0, lambda: preload_pipeline(startup_seconds))
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from utils.config import wear_detection
+from utils.feature_cache import FeatureCache
+
+
+class DetectedWearTimesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.folder.name, "p001.gt3x")
+        with open(self.file_path, "wb") as f:
+            f.write(b"recording")
+        self.cache = FeatureCache(os.path.join(self.folder.name, "cache"))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_key_ignores_detected_windows(self):
+        # The key of a detection run is known before the recording is decoded
+        windows = pd.DataFrame({"studyid": ["p001"],
+                                "WearTimeStart": pd.to_datetime(["2025-01-06 07:00:00"]),
+                                "WearTimeEnd": pd.to_datetime(["2025-01-06 20:00:00"])})
+        self.assertEqual(self.cache.key(self.file_path, None, wear_detection=wear_detection),
+                         self.cache.key(self.file_path, windows, wear_detection=wear_detection))
+        self.assertNotEqual(self.cache.key(self.file_path, None, wear_detection=wear_detection),
+                            self.cache.key(self.file_path, None, wear_detection=dict(wear_detection, min_axes=3)))
+        self.assertNotEqual(self.cache.key(self.file_path, None, wear_detection=wear_detection),
+                            self.cache.key(self.file_path, windows))
+
+    def test_wear_times_saved_with_features(self):
+        key = self.cache.key(self.file_path, None, wear_detection=wear_detection)
+        wear_time_df = pd.DataFrame({"studyid": "p001",
+                                     "WearTimeStart": pd.to_datetime(["2025-01-06 07:00:00", "2025-01-07 08:30:00"]).to_numpy(),
+                                     "WearTimeEnd": pd.to_datetime(["2025-01-06 20:00:00", "2025-01-07 19:15:00"]).to_numpy()})
+        features = pd.DataFrame({"mean": np.arange(4.0), "sd": np.ones(4)})
+        start_times = pd.date_range("2025-01-06 07:00:00", periods=4, freq="5s").tolist()
+        blocks = [(features.iloc[:2], start_times[:2]), (features.iloc[2:], start_times[2:])]
+
+        self.assertIsNone(self.cache.load_wear_times(key, "p001"))
+        self.assertEqual(len(list(self.cache.store_blocks(key, blocks, wear_time_df=wear_time_df))), 2)
+        pd.testing.assert_frame_equal(self.cache.load_wear_times(key, "p001"), wear_time_df)
+        cached_features, cached_start_times = self.cache.load(key)
+        pd.testing.assert_frame_equal(cached_features, features)
+        self.assertEqual(cached_start_times, start_times)
+
+    def test_entries_without_wear_times(self):
+        key = self.cache.key(self.file_path, None)
+        self.cache.save(key, pd.DataFrame({"mean": [1.0]}), [pd.Timestamp("2025-01-06")])
+        self.assertIsNone(self.cache.load_wear_times(key, "p001"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import struct
+import zipfile
+import tempfile
+import unittest
+import numpy as np
+from pygt3x.reader import FileReader
+from benchmarks.synthetic import generate_signal, write_gt3x
+from utils.gt3x_log import open_gt3x, iter_acceleration
+from utils.loader import iter_gt3x_blocks
+
+
+def _record(record_type, timestamp, payload):
+    header = struct.pack("<BBLH", 0x1E, record_type, timestamp, len(payload))
+    checksum = np.bitwise_xor.reduce(np.frombuffer(header + payload, dtype=np.uint8))
+    return header + payload + bytes([~checksum & 0xFF])
+
+
+def write_idle_sleep_gt3x(path, hz=30, seconds=600, idle_sleep=(200, 350)):
+    # ACTIVITY2 records with an idle sleep period, a record with a bad checksum and an unfinished idle sleep at the end
+    rng = np.random.default_rng(0)
+    start = 1736121600
+    records = []
+    for second in range(seconds):
+        if second == idle_sleep[0]:
+            records.append(_record(3, start + second, b"\x08"))
+        elif second == idle_sleep[1]:
+            records.append(_record(3, start + second, b"\x09"))
+        if idle_sleep[0] <= second < idle_sleep[1]:
+            continue
+        record = _record(26, start + second, rng.normal(0, 50, (hz, 3)).astype("<i2").tobytes())
+        if second == 400:
+            record = record[:-1] + bytes([record[-1] ^ 1])
+        records.append(record)
+    records.append(_record(3, start + seconds, b"\x08"))
+    records.append(_record(2, start + seconds + 100, b"\x00\x10"))
+
+    with zipfile.ZipFile(path, "w") as gt3x:
+        gt3x.writestr("log.bin", b"".join(records))
+        gt3x.writestr("info.txt", f"Serial Number: TEST\nSample Rate: {hz}\nAcceleration Scale: 256.0\n")
+
+
+class IterAccelerationTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def assert_same_as_pygt3x(self, path, chunk_seconds):
+        with FileReader(path) as reader:
+            expected = reader.acceleration
+        with open_gt3x(path) as reader:
+            chunks = list(iter_acceleration(reader, chunk_seconds=chunk_seconds))
+        self.assertGreater(len(chunks), 1)
+        np.testing.assert_array_equal(np.concatenate(chunks), expected)
+
+    def test_idle_sleep_and_bad_checksum(self):
+        path = os.path.join(self.folder.name, "idle_sleep.gt3x")
+        write_idle_sleep_gt3x(path)
+        self.assert_same_as_pygt3x(path, chunk_seconds=60)
+
+    def test_blocks_hold_whole_epochs(self):
+        path = os.path.join(self.folder.name, "synthetic.gt3x")
+        write_gt3x(path, generate_signal(1, nonwear_hours=None).slice(0, 30 * 1800))
+        self.assert_same_as_pygt3x(path, chunk_seconds=300)
+
+        blocks = list(iter_gt3x_blocks(path, block_seconds=300, as_signal=True))
+        self.assertEqual([len(block) for block in blocks], [9000] * 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
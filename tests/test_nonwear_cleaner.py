@@ -0,0 +1,28 @@
+import unittest
+import pandas as pd
+from benchmarks.synthetic import iter_signal
+from utils.nonwear_cleaner import detect_wear_times, summarize_wear_times
+
+
+class SummarizeWearTimesTest(unittest.TestCase):
+    def test_continuous_multi_day_recording(self):
+        # Two days of wear without nonwear are detected as one window spanning midnight
+        wear_time_df = detect_wear_times(iter_signal(2, nonwear_hours=None), "p001")
+        self.assertEqual(len(wear_time_df), 1)
+
+        summary = summarize_wear_times(wear_time_df)
+        self.assertEqual([str(date) for date in summary["Date"]], ["2025-01-06", "2025-01-07"])
+        self.assertTrue(((summary["WearDuration"] > 1439) & (summary["WearDuration"] <= 1440)).all())
+        self.assertTrue((summary["NonWearDuration"] >= 0).all())
+
+    def test_window_split_at_midnight(self):
+        wear_time_df = pd.DataFrame({"studyid": ["p001", "p001"],
+                                     "WearTimeStart": pd.to_datetime(["2025-01-06 07:00:00", "2025-01-06 22:00:00"]),
+                                     "WearTimeEnd": pd.to_datetime(["2025-01-06 12:00:00", "2025-01-08 06:00:00"])})
+        summary = summarize_wear_times(wear_time_df)
+        self.assertEqual(summary["WearDuration"].tolist(), [420, 1440, 360])
+        self.assertEqual(summary["NonWearDuration"].tolist(), [1020, 0, 1080])
+
+
+if __name__ == "__main__":
+    unittest.main()
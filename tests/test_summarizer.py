@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+import pandas as pd
+from utils.summarizer import find_bouts, bout_summary
+
+
+class FindBoutsTest(unittest.TestCase):
+    def test_short_interruptions_are_joined(self):
+        inside = np.array([1, 1, 1, 0, 1, 1, 1, 1, 0, 0, 0, 1], dtype=bool)
+        starts, stops, lengths = find_bouts(np.arange(len(inside)), inside, tolerance_epochs=1, min_share=0.8)
+        self.assertEqual(starts.tolist(), [0, 11])
+        self.assertEqual(stops.tolist(), [7, 11])
+        self.assertEqual(lengths.tolist(), [8, 1])
+
+    def test_min_share_limits_joined_interruptions(self):
+        # Alternating 2 epochs in, 2 epochs out: every interruption is within the tolerance
+        inside = np.tile([True, True, False, False], 10)
+        positions = np.arange(len(inside))
+        _, _, lengths = find_bouts(positions, inside, tolerance_epochs=2, min_share=0)
+        self.assertEqual(lengths.tolist(), [38])
+        _, _, lengths = find_bouts(positions, inside, tolerance_epochs=2, min_share=0.8)
+        self.assertEqual(lengths.tolist(), [2] * 10)
+
+
+class BoutSummaryTest(unittest.TestCase):
+    def test_opposite_bouts_cannot_overlap(self):
+        # Alternating 1 minute sedentary and 1 minute active for two hours, in 5 s epochs
+        times = pd.date_range("2025-01-06 08:00:00", periods=1440, freq="5s")
+        predictions = np.where((np.arange(1440) // 12) % 2 == 0, "SED", "TPA")
+        summary = bout_summary(pd.DataFrame({"Time": times, "Prediction": predictions}), classes=["NVM", "SED", "TPA"],
+                               bout_minutes=10, tolerance_minutes=2)
+        self.assertEqual(summary["SED_bouts"].tolist(), [0])
+        self.assertEqual(summary["TPA_bouts"].tolist(), [0])
+        self.assertLessEqual(summary["SED_longest_bout"].iloc[0] + summary["TPA_longest_bout"].iloc[0], 120)
+
+        summary = bout_summary(pd.DataFrame({"Time": times, "Prediction": predictions}), classes=["NVM", "SED", "TPA"],
+                               bout_minutes=10, tolerance_minutes=2, min_share=0)
+        self.assertEqual(summary["SED_bout_minutes"].tolist(), [119])
+        self.assertEqual(summary["TPA_bout_minutes"].tolist(), [119])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
+import json
 import xgboost as xgb
 from sklearn.preprocessing import LabelEncoder
 import numpy as np
+import pandas as pd
 
 def get_label_encoder(classes):
     label_encoder = LabelEncoder()
@@ -16,10 +18,62 @@ def load_xgboost_classifier(path):
     return classifier
 
 
+def predict_probabilities(model, features, batch_size=65536):
+    """
+    Returns the class probabilities for each row of features as an (n, classes) array.
+
+    Parameters:
+        - model: Loaded XGBClassifier or its Booster. The Booster is used directly
+          with inplace_predict, so no DMatrix or pandas copy is built per call.
+        - features: DataFrame or array of features. DataFrames are put in the
+          model's feature order before conversion.
+        - batch_size: Number of rows converted to a float32 matrix and scored at once.
+    """
+    booster = model.get_booster() if isinstance(model, xgb.XGBModel) else model
+    if isinstance(features, pd.DataFrame):
+        if booster.feature_names and list(features.columns) != booster.feature_names:
+            features = features[booster.feature_names]
+        features = features.to_numpy(dtype=np.float32)
+
+    batches = []
+    for start in range(0, len(features), batch_size):
+        batch = np.ascontiguousarray(features[start:start+batch_size], dtype=np.float32)
+        probabilities = booster.inplace_predict(batch)
+        if probabilities.ndim == 1:
+            # Binary models return the probability of the positive class
+            probabilities = np.column_stack((1 - probabilities, probabilities))
+        batches.append(probabilities)
+
+    if not batches:
+        # num_class is 0 for binary models
+        n_classes = int(json.loads(booster.save_config())["learner"]["learner_model_param"]["num_class"])
+        return np.empty((0, max(n_classes, 2)))
+    return np.concatenate(batches)
+
+
+def predict_labels(model, features, start_times, label_encoder, batch_size=65536, probabilities=False):
+    """
+    Scores the features in batches and returns a slim result.
+
+    Returns:
+        - DataFrame with Time and Prediction columns, plus one probability column
+          per class (e.g. "SED_probability") when probabilities is True. The index
+          is the index of features.
+    """
+    class_probabilities = predict_probabilities(model, features, batch_size=batch_size)
+    result = pd.DataFrame({"Time": start_times, "Prediction": label_encoder.inverse_transform(class_probabilities.argmax(axis=1))},
+                          index=features.index if isinstance(features, pd.DataFrame) else None)
+    if probabilities:
+        for column, label in enumerate(label_encoder.classes_):
+            result[f"{label}_probability"] = class_probabilities[:, column]
+
+    return result
+
+
 def predict(model, features, start_times, label_encoder):
-    prediction = model.predict(features)
+    prediction = predict_labels(model, features, start_times, label_encoder)
 
-    features['Prediction'] = label_encoder.inverse_transform(prediction)
+    features['Prediction'] = prediction['Prediction']
     features['Time'] = start_times
 
-    return features
\ No newline at end of file
+    return features
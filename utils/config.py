@@ -0,0 +1,40 @@
+import os
+
+# Settings shared by the GUI, the command line and the pipeline. This module
+# only uses the standard library so that it can be imported before the
+# scientific stack is loaded.
+
+# Model file and label classes for each outcome selection
+outcome_models = {
+    "NVM_TPA_SED": ("models/NVM-0_SED-1_TPA-2_5sIntPos.json", ['NVM', 'SED', 'TPA']),
+    "NVM_LPA_MVPA_SED": ("models/NVM-0_SED-1_LPA-2_MVPA-3_5sIntPos.json", ['NVM', 'SED', 'LPA', 'MVPA']),
+}
+
+# Environment variable naming another folder holding the model files, e.g. the throwaway
+# models written by the benchmarks. By default they are read from models/ (see the README).
+model_folder_variable = "LITTLE_MOVERS_MODEL_FOLDER"
+
+default_cache_folder = os.path.join(os.path.expanduser("~"), ".little_movers", "feature_cache")
+
+# Settings of utils.nonwear_cleaner.detect_wear_times for the "Accelerometer" non-wear method
+wear_detection = {"window_minutes": 60, "step_minutes": 15, "sd_threshold": 0.013, "range_threshold": 0.05, "min_axes": 2}
+
+# Epoch length (seconds) and sampling rate (Hz) the models were trained on. Recordings
+# made at another sample rate are resampled to model_hz before feature extraction.
+model_epoch = 5
+model_hz = 30
+
+# Start-up and pipeline preload times of the app, one JSON line per launch
+startup_log_file = os.path.join(os.path.expanduser("~"), ".little_movers", "startup_times.jsonl")
+
+# Decoded recordings kept by utils.signal_cache (opt-in, about 16 bytes per sample)
+default_signal_cache_folder = os.path.join(os.path.expanduser("~"), ".little_movers", "signal_cache")
+
+# Bout summary: labels counted towards each bout type (NVM and SED together are sedentary
+# time), the shortest bout in minutes, the longest interruption allowed within a bout and
+# the share of a bout's epochs that must have its labels. A share above 0.5 keeps bouts
+# of opposite types from covering the same time.
+bout_labels = {"SED": ["NVM", "SED"], "TPA": ["TPA", "LPA", "MVPA"], "MVPA": ["MVPA"]}
+bout_minutes = 10
+bout_tolerance_minutes = 2
+bout_min_share = 0.8
@@ -0,0 +1,206 @@
+import os
+import json
+import shutil
+import zipfile
+import contextlib
+import hashlib
+import numpy as np
+import pandas as pd
+from utils.feature_extraction import feature_dict
+from utils.config import default_cache_folder
+
+# Bump when the feature engine changes in a way that alters values
+feature_engine_version = 3
+
+
+# Hashes already computed in this process, keyed by path, size and mtime
+_file_hashes = {}
+
+
+def hash_file(path, chunk_size=1 << 20):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _file_hashes:
+        return _file_hashes[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def _wear_arrays(wear_time_df):
+    # Extra .npz members holding detected wear windows
+    if wear_time_df is None:
+        return {}
+    return {"wear_starts": pd.to_datetime(wear_time_df["WearTimeStart"]).to_numpy(dtype="datetime64[ns]"),
+            "wear_ends": pd.to_datetime(wear_time_df["WearTimeEnd"]).to_numpy(dtype="datetime64[ns]")}
+
+
+class FeatureCache:
+    """
+    On-disk cache of per-epoch feature matrices.
+
+    Entries are .npz files of .npy arrays (features, epoch start times and
+    column names), named by a hash of the .gt3x contents, the wear windows,
+    epoch/hz and feature_dict. When the folder grows past max_bytes the
+    least recently used entries are deleted.
+
+    Wear times detected from the recording itself depend only on the file
+    and the detection settings, so those entries are keyed by wear_detection
+    instead of the windows, and keep the detected windows (see
+    load_wear_times). A hit then skips decoding the recording altogether.
+    """
+
+    def __init__(self, cache_folder=default_cache_folder, max_bytes=5 * 1024**3):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def key(self, file_path, wear_time_df, epoch=5, hz=30, hop=None, wear_detection=None):
+        if wear_time_df is None or wear_detection is not None:
+            wear_windows = None
+        else:
+            wear_windows = wear_time_df[["WearTimeStart", "WearTimeEnd"]].astype(str).to_numpy().tolist()
+
+        settings = {
+            "file": hash_file(file_path),
+            "wear_windows": wear_windows,
+            "epoch": epoch,
+            "hz": hz,
+            "features": feature_dict,
+            "version": feature_engine_version,
+        }
+        if hop is not None:
+            # Only overlapping windows add the key, so existing entries stay valid
+            settings["hop"] = hop
+        if wear_detection is not None:
+            settings["wear_detection"] = wear_detection
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_folder, key + ".npz")
+
+    def load(self, key):
+        """
+        Returns (features, start_times) for the key, or None when it is not cached.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                features = pd.DataFrame(entry["features"], columns=entry["columns"].tolist())
+                start_times = pd.to_datetime(entry["start_times"]).tolist()
+        except (OSError, ValueError, KeyError):
+            # Unreadable or just evicted entries are treated as misses
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+
+        os.utime(path)  # Mark as recently used
+        return features, start_times
+
+    def load_wear_times(self, key, studyid):
+        """
+        Returns the wear times saved with the key's entry, in the format of
+        detect_wear_times, or None when the entry is missing or has none.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                if "wear_starts" not in entry.files:
+                    return None
+                starts = pd.to_datetime(entry["wear_starts"])
+                ends = pd.to_datetime(entry["wear_ends"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return pd.DataFrame({"studyid": studyid, "WearTimeStart": starts.to_numpy(), "WearTimeEnd": ends.to_numpy()})
+
+    def save(self, key, features, start_times, wear_time_df=None):
+        path = self._path(key)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path,
+                 features=features.to_numpy(dtype=np.float64),
+                 columns=np.array(features.columns, dtype=str),
+                 start_times=np.array(start_times, dtype="datetime64[ns]"),
+                 **_wear_arrays(wear_time_df))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def store_blocks(self, key, feature_blocks, wear_time_df=None):
+        """
+        Passes (features, start_times) blocks through, saving them all under key once the stream ends.
+        Detected wear times given as wear_time_df are saved with them.
+
+        The feature values are written to a temporary file as the blocks pass,
+        so only the start times are kept in memory, and are then copied into
+        the .npz entry in chunks.
+        """
+        path = self._path(key)
+        values_path = path + ".values.tmp"
+        start_times = []
+        columns = None
+        n_rows = 0
+        completed = False
+        try:
+            with open(values_path, "wb") as f:
+                for block_features, block_start_times in feature_blocks:
+                    # Written before the caller adds prediction columns to the frame
+                    columns = list(block_features.columns)
+                    f.write(np.ascontiguousarray(block_features.to_numpy(dtype="<f8")).tobytes())
+                    n_rows += len(block_features)
+                    start_times.append(np.array(block_start_times, dtype="datetime64[ns]"))
+                    yield block_features, block_start_times
+            if n_rows:
+                self._save_streamed(path, values_path, n_rows, columns, np.concatenate(start_times), wear_time_df)
+            completed = True
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(values_path)
+            if not completed:
+                with contextlib.suppress(OSError):
+                    os.remove(path + ".tmp.npz")
+
+    def _save_streamed(self, path, values_path, n_rows, columns, start_times, wear_time_df=None):
+        # Same .npz layout as save(), with the features copied from values_path
+        tmp_path = path + ".tmp.npz"
+        with zipfile.ZipFile(tmp_path, "w", allowZip64=True) as archive:
+            with archive.open("features.npy", "w", force_zip64=True) as f:
+                header = {"descr": np.lib.format.dtype_to_descr(np.dtype("<f8")), "fortran_order": False, "shape": (n_rows, len(columns))}
+                np.lib.format.write_array_header_1_0(f, header)
+                with open(values_path, "rb") as values:
+                    shutil.copyfileobj(values, f, 16 * 1024**2)
+            with archive.open("columns.npy", "w") as f:
+                np.lib.format.write_array(f, np.array(columns, dtype=str))
+            with archive.open("start_times.npy", "w") as f:
+                np.lib.format.write_array(f, start_times)
+            for name, values in _wear_arrays(wear_time_df).items():
+                with archive.open(name + ".npy", "w") as f:
+                    np.lib.format.write_array(f, values)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for filename in os.listdir(self.cache_folder):
+            if filename.endswith(".npz") and not filename.endswith(".tmp.npz"):
+                with contextlib.suppress(OSError):
+                    stat = os.stat(os.path.join(self.cache_folder, filename))
+                    entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.cache_folder, filename))
+            total -= size
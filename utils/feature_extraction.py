@@ -1,5 +1,9 @@
+import math
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import numpy as np
 import pandas as pd
-import tsfresh
+from utils.raw_signal import RawSignal, signal_columns
 
 # #features to extract
 feature_dict = {
@@ -51,8 +55,474 @@ feature_dict = {
     ]
 }
 
+def _zero_out_fperr(values):
+    # Same floating point guard pandas applies in Series.skew/Series.kurtosis
+    return np.where(np.abs(values) < 1e-14, 0, values)
+
+
+def _skewness(x):
+    adjusted = x - x.mean(axis=1, keepdims=True)
+    adjusted2 = adjusted**2
+    return _skewness_from_moments(x.shape[1], adjusted2.sum(axis=1), (adjusted2 * adjusted).sum(axis=1))
+
+
+def _skewness_from_moments(count, m2, m3):
+    # m2 and m3 are sums of squared and cubed deviations from the mean
+    m2 = _zero_out_fperr(m2)
+    m3 = _zero_out_fperr(m3)
+    if count < 3:
+        return np.full(m2.shape[0], np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2**1.5)
+    return np.where(m2 == 0, 0, result)
+
+
+def _kurtosis(x):
+    adjusted2 = (x - x.mean(axis=1, keepdims=True))**2
+    return _kurtosis_from_moments(x.shape[1], adjusted2.sum(axis=1), (adjusted2**2).sum(axis=1))
+
+
+def _kurtosis_from_moments(count, m2, m4):
+    if count < 4:
+        return np.full(m2.shape[0], np.nan)
+    adj = 3 * (count - 1) ** 2 / ((count - 2) * (count - 3))
+    numerator = _zero_out_fperr(count * (count + 1) * (count - 1) * m4)
+    denominator = _zero_out_fperr((count - 2) * (count - 3) * m2**2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = numerator / denominator - adj
+    return np.where(denominator == 0, 0, result)
+
+
+def _window_moments(chunks, chunks_per_window):
+    """
+    Central moments of overlapping windows made of consecutive chunks.
+
+    Each chunk's count, mean and sums of powered deviations are computed
+    once and merged into every window containing it with the pairwise update
+    of Chan et al., which stays accurate for near-constant signals (unlike
+    running sums of powers).
+
+    Parameters:
+        - chunks: Array (n_chunks, chunk_length) of one channel.
+        - chunks_per_window: Number of consecutive chunks in a window.
+
+    Returns:
+        - Dictionary of per-window count, mean, m2, m3, m4 (sums of powered
+          deviations), sum and sum_squares.
+    """
+    chunk_length = chunks.shape[1]
+    chunk_mean = chunks.mean(axis=1)
+    deviation = chunks - chunk_mean[:, None]
+    deviation2 = deviation**2
+    chunk_m2 = deviation2.sum(axis=1)
+    chunk_m3 = (deviation2 * deviation).sum(axis=1)
+    chunk_m4 = (deviation2**2).sum(axis=1)
+    chunk_squares = np.square(chunks).sum(axis=1)
+    chunk_sum = chunks.sum(axis=1)
+
+    n_windows = len(chunks) - chunks_per_window + 1
+    count = chunk_length
+    mean = chunk_mean[:n_windows]
+    m2 = chunk_m2[:n_windows]
+    m3 = chunk_m3[:n_windows]
+    m4 = chunk_m4[:n_windows]
+    sum_squares = chunk_squares[:n_windows]
+    total = chunk_sum[:n_windows]
+    nb = chunk_length
+    for j in range(1, chunks_per_window):
+        na = count
+        count = na + nb
+        mean_b = chunk_mean[j:j + n_windows]
+        m2_b = chunk_m2[j:j + n_windows]
+        m3_b = chunk_m3[j:j + n_windows]
+        delta = mean_b - mean
+        m4 = (m4 + chunk_m4[j:j + n_windows] + delta**4 * na * nb * (na*na - na*nb + nb*nb) / count**3
+              + 6 * delta**2 * (na*na * m2_b + nb*nb * m2) / count**2 + 4 * delta * (na * m3_b - nb * m3) / count)
+        m3 = m3 + m3_b + delta**3 * na * nb * (na - nb) / count**2 + 3 * delta * (na * m2_b - nb * m2) / count
+        m2 = m2 + m2_b + delta**2 * na * nb / count
+        mean = mean + delta * nb / count
+        sum_squares = sum_squares + chunk_squares[j:j + n_windows]
+        total = total + chunk_sum[j:j + n_windows]
+
+    return {"count": count, "mean": mean, "m2": m2, "m3": m3, "m4": m4, "sum": total, "sum_squares": sum_squares}
+
+
+def _fft_moment(fft_abs, moment):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return fft_abs.dot(np.arange(fft_abs.shape[1], dtype=float) ** moment) / fft_abs.sum(axis=1)
+
+
+def _fft_aggregated(fft_abs, aggtype):
+    centroid = _fft_moment(fft_abs, 1)
+    if aggtype == "centroid":
+        return centroid
+    variance = _fft_moment(fft_abs, 2) - centroid**2
+    if aggtype == "variance":
+        return variance
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if aggtype == "skew":
+            result = (_fft_moment(fft_abs, 3) - 3 * centroid * variance - centroid**3) / variance**1.5
+        elif aggtype == "kurtosis":
+            result = (_fft_moment(fft_abs, 4) - 4 * centroid * _fft_moment(fft_abs, 3)
+                      + 6 * _fft_moment(fft_abs, 2) * centroid**2 - 3 * centroid) / variance**2
+        else:
+            raise ValueError(f"Unsupported fft_aggregated aggtype: {aggtype}")
+    # tsfresh treats spectra narrower than half a bin as undefined
+    return np.where(variance < 0.5, np.nan, result)
+
+
+def _binned_entropy(x, bins):
+    # Row-wise np.histogram with equal-width bins, reproducing numpy's edge handling
+    n_rows, n_values = x.shape
+    result = np.full(n_rows, np.nan)
+    valid = ~np.isnan(x).any(axis=1)
+    x = x[valid]
+    if len(x) == 0:
+        return result
+
+    first_edge = x.min(axis=1)
+    last_edge = x.max(axis=1)
+    empty_range = first_edge == last_edge
+    first_edge = np.where(empty_range, first_edge - 0.5, first_edge)
+    last_edge = np.where(empty_range, last_edge + 0.5, last_edge)
+    bin_edges = np.linspace(first_edge, last_edge, bins + 1, axis=1)
+
+    indices = (((x - first_edge[:, None]) / (last_edge - first_edge)[:, None]) * bins).astype(np.intp)
+    indices[indices == bins] -= 1
+    rows = np.arange(len(x))[:, None]
+    indices[x < bin_edges[rows, indices]] -= 1
+    indices[(x >= bin_edges[rows, indices + 1]) & (indices != bins - 1)] += 1
+
+    counts = np.bincount((rows * bins + indices).ravel(), minlength=len(x) * bins).reshape(len(x), bins)
+    probs = counts / n_values
+    probs[probs == 0] = 1.0
+    result[valid] = -np.sum(probs * np.log(probs), axis=1)
+    return result
+
+
+def _welch_psd(x, max_length_per_segment=256):
+    # scipy.signal.welch defaults (hann window, 50% overlap, constant detrend, density scaling) over each row
+    nperseg = min(x.shape[1], max_length_per_segment)
+    segments = np.lib.stride_tricks.sliding_window_view(x, nperseg, axis=1)[:, ::nperseg - nperseg // 2]
+    window = np.hanning(nperseg + 1)[:-1]
+    segments = (segments - segments.mean(axis=2, keepdims=True)) * window
+    pxx = np.abs(np.fft.rfft(segments, axis=2))**2 / (window * window).sum()
+    if nperseg % 2:
+        pxx[:, :, 1:] *= 2
+    else:
+        pxx[:, :, 1:-1] *= 2
+    return pxx.mean(axis=1)
+
+
+def _fourier_entropy(x, bins):
+    pxx = _welch_psd(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _binned_entropy(pxx / pxx.max(axis=1, keepdims=True), bins)
+
+
+def _quantile(sorted_x, q):
+    # np.quantile's default linear method, applied to rows that are already sorted
+    n = sorted_x.shape[1]
+    virtual_index = n * q + (1 - q) - 1
+    previous_index = int(np.clip(np.floor(virtual_index), 0, n - 1))
+    next_index = min(previous_index + 1, n - 1)
+    gamma = virtual_index - np.floor(virtual_index)
+    a = sorted_x[:, previous_index]
+    b = sorted_x[:, next_index]
+    diff_b_a = b - a
+    if gamma >= 0.5:
+        return b - diff_b_a * (1 - gamma)
+    return a + diff_b_a * gamma
+
+
+def _median(sorted_x):
+    n = sorted_x.shape[1]
+    if n % 2:
+        return sorted_x[:, n // 2]
+    return (sorted_x[:, n // 2 - 1] + sorted_x[:, n // 2]) / 2
+
+
+def _complex_agg(values, attr):
+    if attr == "real":
+        return values.real
+    elif attr == "imag":
+        return values.imag
+    elif attr == "abs":
+        return np.abs(values)
+    elif attr == "angle":
+        return np.angle(values, deg=True)
+    raise ValueError(f"Unsupported fft_coefficient attr: {attr}")
+
+
+def _channel_features(x, fc_parameters, moments=None):
+    # Features for one signal column, x has shape (n_epochs, epoch_length). moments
+    # (from _window_moments) replaces the per-epoch mean, deviation and power sums.
+    n_epochs = x.shape[0]
+    fft = np.fft.rfft(x, axis=1)
+    fft_abs = None
+    sorted_x = np.sort(x, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if moments is None:
+            mean = x.mean(axis=1)
+            std = x.std(axis=1)
+        else:
+            mean = moments["mean"]
+            std = np.sqrt(moments["m2"] / moments["count"])
+
+    for name, params in fc_parameters.items():
+        if name == "mean":
+            yield name, mean
+        elif name == "standard_deviation":
+            yield name, std
+        elif name == "minimum":
+            yield name, sorted_x[:, 0]
+        elif name == "maximum":
+            yield name, sorted_x[:, -1]
+        elif name == "quantile":
+            for param in params:
+                yield f"{name}__q_{param['q']}", _quantile(sorted_x, param["q"])
+        elif name == "variation_coefficient":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                yield name, np.where(mean == 0, np.nan, std / mean)
+        elif name == "sum_values":
+            yield name, x.sum(axis=1) if moments is None else moments["sum"]
+        elif name == "median":
+            yield name, _median(sorted_x)
+        elif name == "skewness":
+            yield name, _skewness(x) if moments is None else _skewness_from_moments(moments["count"], moments["m2"], moments["m3"])
+        elif name == "kurtosis":
+            yield name, _kurtosis(x) if moments is None else _kurtosis_from_moments(moments["count"], moments["m2"], moments["m4"])
+        elif name == "root_mean_square":
+            yield name, np.sqrt(np.mean(np.square(x), axis=1) if moments is None else moments["sum_squares"] / moments["count"])
+        elif name == "fft_aggregated":
+            if fft_abs is None:
+                fft_abs = np.abs(fft)
+            for param in params:
+                yield f'{name}__aggtype_"{param["aggtype"]}"', _fft_aggregated(fft_abs, param["aggtype"])
+        elif name == "fourier_entropy":
+            for param in params:
+                yield f"{name}__bins_{param['bins']}", _fourier_entropy(x, param["bins"])
+        elif name == "fft_coefficient":
+            for param in params:
+                coeff = param["coeff"]
+                if coeff < fft.shape[1]:
+                    values = _complex_agg(fft[:, coeff], param["attr"])
+                else:
+                    values = np.full(n_epochs, np.nan)
+                yield f'{name}__attr_"{param["attr"]}"__coeff_{coeff}', values
+        else:
+            raise ValueError(f"Unsupported feature calculator: {name}")
+
+
+def compute_epoch_features(epochs, fc_parameters=feature_dict):
+    """
+    Computes the tsfresh features for every epoch at once.
+
+    Parameters:
+        - epochs: array of shape (n_epochs, epoch_length, len(signal_columns)).
+        - fc_parameters: tsfresh style dictionary of features to compute.
+
+    Returns:
+        - DataFrame with one row per epoch and tsfresh column names.
+    """
+    features = {}
+    for channel, column in enumerate(signal_columns):
+        x = np.ascontiguousarray(epochs[:, :, channel], dtype=np.float64)
+        for name, values in _channel_features(x, fc_parameters):
+            features[f"{column}__{name}"] = values
+
+    return pd.DataFrame(features)
+
+
+def compute_window_features(values, n_windows, group_size, hop_size, fc_parameters=feature_dict):
+    """
+    Computes the tsfresh features of overlapping windows.
+
+    Window i is rows i*hop_size to i*hop_size + group_size of values, and
+    hop_size divides group_size. The windows are a strided view of values,
+    so FFTs and sorting run batched without copying the overlap, and the
+    moment features (mean, standard deviation, skewness, kurtosis, sum and
+    root mean square) are merged from hop-sized chunks computed once (see
+    _window_moments) instead of being recomputed for every window. The
+    columns match compute_epoch_features, with values equal up to rounding.
+    """
+    n_rows = (n_windows - 1) * hop_size + group_size
+    windows = np.lib.stride_tricks.sliding_window_view(values[:n_rows], group_size, axis=0)[::hop_size]
+    features = {}
+    for channel, column in enumerate(signal_columns):
+        x = np.ascontiguousarray(windows[:, channel, :], dtype=np.float64)
+        chunks = np.asarray(values[:n_rows, channel], dtype=np.float64).reshape(-1, hop_size)
+        moments = _window_moments(chunks, group_size // hop_size)
+        for name, channel_values in _channel_features(x, fc_parameters, moments):
+            features[f"{column}__{name}"] = channel_values
+
+    return pd.DataFrame(features)
+
+
+def _split_epochs(epochs, n_chunks):
+    # Contiguous chunks on epoch boundaries, in recording order
+    chunk_size = max(1, math.ceil(len(epochs) / n_chunks))
+    return [epochs[i:i+chunk_size] for i in range(0, len(epochs), chunk_size)]
+
+
+def _segments(data, hz):
+    # First row and start time of each gap-free segment
+    if isinstance(data, RawSignal):
+        return data.segment_offsets, data.segment_starts
+    times = data['Datetime'].to_numpy(dtype="datetime64[ns]")
+    step = 1e9 / hz
+    gaps = np.abs(np.diff(times.astype(np.int64)) - step) > step / 2
+    offsets = np.concatenate(([0], np.flatnonzero(gaps) + 1))
+    return offsets, times[offsets] if len(times) else times[:0]
+
+
+def epoch_index(data, epoch=5, hz=30, hop=None):
+    """
+    Returns the first row of every full epoch in the data.
+
+    Epochs are aligned to wall-clock multiples of epoch seconds within each
+    gap-free segment (a wear window after trimming), so no epoch straddles a
+    gap. The samples before a segment's first boundary and after its last
+    full epoch are not scored. Because the boundaries depend only on the
+    timestamps, the epochs are the same however the recording is split into
+    blocks.
+
+    Parameters:
+        - data: DataFrame with a Datetime column, or a RawSignal.
+        - epoch: Epoch length in seconds.
+        - hz: Sampling frequency of the data.
+        - hop: Seconds between the starts of consecutive windows (default
+          epoch). With a hop shorter than the epoch the windows overlap, and
+          they start on wall-clock multiples of hop.
+    """
+    group_size = epoch*hz
+    hop = epoch if hop is None else hop
+    hop_size = int(round(hop*hz))
+    hop_ns = int(round(hop * 10**9))
+    offsets, segment_starts = _segments(data, hz)
+    ends = np.append(offsets[1:], len(data))
+
+    starts = []
+    for offset, segment_start, end in zip(offsets, segment_starts.astype(np.int64), ends):
+        boundary = -(-segment_start // hop_ns) * hop_ns
+        first = offset + int(np.ceil((boundary - segment_start) * hz / 1e9 - 1e-6))
+        if first < 0:
+            first += -(first // hop_size) * hop_size
+        starts.append(np.arange(first, end - group_size + 1, hop_size))
+
+    if not starts:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(starts).astype(np.int64)
+
+
+def _window_runs(starts, hop_size, max_windows):
+    # (first row, number of windows) of each run of windows hop_size apart, split into at most max_windows
+    breaks = np.flatnonzero(np.diff(starts) != hop_size) + 1
+    runs = []
+    for run in np.split(starts, breaks):
+        for i in range(0, len(run), max_windows):
+            runs.append((int(run[i]), len(run[i:i+max_windows])))
+    return runs
+
+
+def _features_at(data, starts, group_size, n_jobs=1, use_processes=False, hop_size=None):
+    # Features and start times of the windows starting at the given rows
+    if isinstance(data, RawSignal):
+        values = data.values
+        start_times = pd.to_datetime(data.timestamps(starts)).tolist()
+    else:
+        values = data[signal_columns].to_numpy(dtype=np.float64)
+        start_times = data['Datetime'].iloc[starts].tolist()
+
+    hop_size = group_size if hop_size is None else hop_size
+    if hop_size < group_size and group_size % hop_size == 0 and len(starts):
+        # Overlapping windows share their hop-sized chunks (see compute_window_features)
+        max_windows = max(1, math.ceil(len(starts) / (n_jobs * 4))) if n_jobs > 1 else len(starts)
+        runs = _window_runs(starts, hop_size, max_windows)
+        tasks = ([values[first:first + (n - 1) * hop_size + group_size] for first, n in runs], [n for _, n in runs],
+                 [group_size] * len(runs), [hop_size] * len(runs))
+        function = compute_window_features
+    else:
+        epochs = values[starts[:, None] + np.arange(group_size)]
+        tasks = (_split_epochs(epochs, n_jobs * 4) if n_jobs > 1 and len(epochs) > 1 else [epochs],)
+        function = compute_epoch_features
+
+    if n_jobs > 1 and len(tasks[0]) > 1:
+        # A few chunks per worker keeps the pool busy when chunks finish unevenly
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+        with executor:
+            features = list(executor.map(function, *tasks))
+    else:
+        features = list(map(function, *tasks))
+
+    return (pd.concat(features, ignore_index=True), start_times)
+
+
+def extract_features_with_start_times(df, epoch=5, hz=30, n_jobs=1, use_processes=False, hop=None):
+    """
+    Extracts the model features for each epoch of the data.
+
+    Only full epochs on wall-clock boundaries are scored (see epoch_index).
+
+    Parameters:
+        - df: DataFrame with Datetime and signal columns, or a RawSignal.
+        - epoch: Epoch length in seconds.
+        - hz: Sampling frequency of the data.
+        - n_jobs: Number of workers the epochs are split across.
+        - use_processes: Use a process pool instead of a thread pool.
+        - hop: Seconds between window starts (default epoch). A shorter hop
+          gives overlapping epoch-length windows with the same feature columns.
+
+    Returns:
+        - features: DataFrame with one row of features per epoch.
+        - start_times: Start time of each epoch.
+    """
+    hop_size = None if hop is None else int(round(hop*hz))
+    return _features_at(df, epoch_index(df, epoch, hz, hop), epoch*hz, n_jobs=n_jobs, use_processes=use_processes, hop_size=hop_size)
+
+
+def _slice_rows(block, start, stop):
+    if isinstance(block, RawSignal):
+        return block.slice(start, stop)
+    return block.iloc[start:stop]
+
+
+def iter_features_with_start_times(blocks, epoch=5, hz=30, n_jobs=1, use_processes=False, hop=None):
+    """
+    Extracts features from a stream of data blocks, yielding (features, start_times) per block.
+
+    The rows of the last segment from its next window start on are carried
+    into the next block, so the windows are the same as
+    extract_features_with_start_times would find on the concatenated blocks.
+    Rows still carried at the end of the stream do not make a full window.
+    """
+    group_size = epoch*hz  # Number of rows in each epoch
+    hop_size = int(round((epoch if hop is None else hop)*hz))
+    carry = None
+    n_epochs = 0
+
+    for block in blocks:
+        if carry is not None and len(carry):
+            block = RawSignal.concatenate([carry, block]) if isinstance(block, RawSignal) else pd.concat([carry, block])
+
+        starts = epoch_index(block, epoch, hz, hop)
+        last_segment = max(0, _segments(block, hz)[0][-1]) if len(block) else 0
+        keep = starts[-1] + hop_size if len(starts) and starts[-1] >= last_segment else last_segment
+        carry = _slice_rows(block, keep, len(block))
+        if len(starts):
+            features, start_times = _features_at(block, starts, group_size, n_jobs=n_jobs, use_processes=use_processes, hop_size=hop_size)
+            features.index += n_epochs
+            n_epochs += len(features)
+            yield features, start_times
+
+
+def extract_features_with_start_times_tsfresh(df, epoch=5, hz=30):
+    # Reference implementation calling tsfresh once per epoch, kept to validate compute_epoch_features
+    import tsfresh
 
-def extract_features_with_start_times(df, epoch=5, hz=30):
     group_size = epoch*hz  # Number of rows to process at once
 
     features_merged = pd.DataFrame()
@@ -0,0 +1,181 @@
+import struct
+import logging
+import numpy as np
+from pygt3x import Types
+from pygt3x.reader import FileReader
+from pygt3x.activity_payload import read_activity1_payload, read_activity2_payload, read_activity3_payload
+
+logger = logging.getLogger(__name__)
+
+# Log record header: separator, type, timestamp (s), payload size. A checksum byte follows the payload.
+_header = struct.Struct("<BBLH")
+
+_payload_readers = {Types.Activity.value: read_activity1_payload, Types.Activity2.value: read_activity2_payload,
+                    Types.Activity3.value: read_activity3_payload}
+
+
+def open_gt3x(path):
+    """
+    Returns a pygt3x FileReader that reads info.txt and the calibration but
+    does not decode the activity log when it is entered.
+
+    Older NHANES files (activity.bin instead of log.bin) are still decoded
+    whole by pygt3x, into reader.acceleration.
+    """
+    return FileReader(path, num_rows=0)
+
+
+def iter_log_records(log, read_size=1 << 22):
+    """
+    Yields (type, timestamp, payload, checksum valid) for each complete
+    record of a log.bin stream, reading read_size bytes at a time. Reading
+    stops at a record cut off by the end of the file, as pygt3x does.
+    """
+    pending = b""
+    while True:
+        data = log.read(read_size)
+        chunk = pending + data if pending else data
+        records = []
+        position = 0
+        while len(chunk) - position >= _header.size + 1:
+            _, record_type, timestamp, size = _header.unpack_from(chunk, position)
+            stop = position + _header.size + size + 1
+            if stop > len(chunk):
+                break
+            records.append((position, record_type, timestamp, size))
+            position = stop
+
+        if records:
+            # A record is valid when the XOR of all its bytes, checksum included, is 0xFF
+            starts = np.array([record[0] for record in records])
+            valid = np.bitwise_xor.reduceat(np.frombuffer(chunk, dtype=np.uint8, count=position), starts) == 0xFF
+            for (start, record_type, timestamp, size), is_valid in zip(records, valid):
+                payload_start = start + _header.size
+                yield record_type, timestamp, chunk[payload_start:payload_start + size], is_valid
+
+        pending = chunk[position:]
+        if not data:
+            return
+
+
+class _SampleBuffer:
+    # Seconds of samples in the order they were read, released in time order once chunk_seconds behind the newest
+
+    def __init__(self, chunk_seconds):
+        self.chunk_seconds = chunk_seconds
+        self.seconds = []
+        self.last_released = None
+
+    def release(self, final=False):
+        if not self.seconds or (not final and len(self.seconds) < 2 * self.chunk_seconds):
+            return None
+
+        times = np.array([second[0, 0] for second in self.seconds])
+        ready = np.ones(len(times), dtype=bool) if final else times < times.max() - self.chunk_seconds
+        taken = [second for second, is_ready in zip(self.seconds, ready) if is_ready]
+        self.seconds = [second for second, is_ready in zip(self.seconds, ready) if not is_ready]
+        if not taken:
+            return None
+
+        try:
+            # Sorts the seconds and drops identical ones, like pygt3x
+            samples = np.unique(np.stack(taken), axis=0).reshape(-1, 5)
+        except ValueError:
+            # Seconds of unexpected lengths cannot be stacked
+            samples = np.concatenate(taken)
+            samples = samples[np.argsort(samples[:, 0], kind="stable")]
+
+        if self.last_released is not None:
+            late = samples[:, 0] < np.floor(self.last_released) + 1
+            if late.any():
+                logger.warning("%s samples recorded before already read data dropped.", int(late.sum()))
+                samples = samples[~late]
+        if len(samples):
+            self.last_released = samples[-1, 0]
+        return samples
+
+
+def iter_acceleration(reader, chunk_seconds=3600):
+    """
+    Decodes the activity log of an open_gt3x reader incrementally.
+
+    Yields arrays of Timestamp, X, Y, Z and IdleSleepMode columns, like
+    pygt3x's FileReader.acceleration, in time order and about chunk_seconds
+    at a time. Records are handled as pygt3x does (checksums, idle sleep
+    mode gaps filled with the last sample, identical seconds dropped), but
+    only about two chunks of seconds are held at once. Records whose clock
+    went back by more than chunk_seconds are dropped with a warning instead
+    of being sorted into data already yielded.
+    """
+    if reader.nhanes:
+        size = chunk_seconds * reader.info.sample_rate
+        for start in range(0, len(reader.acceleration), size):
+            yield reader.acceleration[start:start + size]
+        return
+
+    buffer = _SampleBuffer(chunk_seconds)
+    idle_sleep_mode_started = None
+    last_values = None
+    last_idle_sleep_event = 0
+    dt_idle_sleep = 0
+    timestamp = None
+
+    def fill_idle_sleep(start, end):
+        # Seconds without records while the device slept repeat the last sample, one chunk at a time
+        for piece_start in np.arange(start, end, chunk_seconds):
+            buffer.seconds.extend(reader._fill_ism(piece_start, min(piece_start + chunk_seconds, end), last_values))
+            yield buffer.release()
+
+    for record_type, timestamp, payload_bytes, is_valid in iter_log_records(reader.logfile):
+        if not is_valid:
+            logger.warning("Event checksum does not match at %s .", timestamp)
+            continue
+
+        dt = timestamp - buffer.seconds[-1][0, 0] if buffer.seconds else 0
+        time_travel = last_idle_sleep_event > timestamp
+
+        if record_type == Types.Event.value and payload_bytes == b"\x08":
+            last_idle_sleep_event = timestamp
+            dt_idle_sleep = dt
+            idle_sleep_mode_started = timestamp
+            continue
+        if record_type == Types.Event.value and payload_bytes == b"\x09":
+            if idle_sleep_mode_started is not None and last_values is not None:
+                last_idle_sleep_event = timestamp
+                for samples in fill_idle_sleep(idle_sleep_mode_started - (dt_idle_sleep - 1), timestamp):
+                    if samples is not None:
+                        yield samples
+                idle_sleep_mode_started = None
+            continue
+
+        read_payload = _payload_readers.get(record_type)
+        # One-byte activity records mark a USB connection, not a reading
+        if read_payload is None or (record_type != Types.Activity2.value and len(payload_bytes) == 1):
+            continue
+
+        payload = read_payload(payload_bytes, timestamp, reader.info.sample_rate)
+        if payload.shape[0] == 0:
+            continue
+        last_values = payload[-1, 1:]
+        idle_sleep_mode_started = None
+
+        index = int(dt) - 1
+        if time_travel and -len(buffer.seconds) <= index < 0:
+            # A record written again after the clock was set back replaces the one read for that second
+            buffer.seconds[index] = payload
+        else:
+            buffer.seconds.append(payload)
+
+        samples = buffer.release()
+        if samples is not None:
+            yield samples
+
+    if idle_sleep_mode_started is not None and last_values is not None:
+        # Idle sleep mode lasted until the end of the recording
+        for samples in fill_idle_sleep(idle_sleep_mode_started - (dt_idle_sleep - 1), timestamp):
+            if samples is not None:
+                yield samples
+
+    samples = buffer.release(final=True)
+    if samples is not None:
+        yield samples
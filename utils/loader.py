@@ -1,5 +1,9 @@
 from pygt3x.reader import FileReader
+import numpy as np
 import pandas as pd
+from utils.raw_signal import RawSignal
+from utils.resample import resample_stream_blocks
+from utils.gt3x_log import open_gt3x, iter_acceleration
 
 def load_gt3x(path):
     with FileReader(path) as reader:
@@ -9,5 +13,162 @@ def load_gt3x(path):
         return dfraw
 
 
-def load_raw_accel_file(path):
-    return load_gt3x(path)
\ No newline at end of file
+def _gt3x_xyz(reader, acceleration):
+    if reader.nhanes:
+        return acceleration[:, 1:4]
+    return reader.calibrate_acceleration(acceleration[:, 1:4])
+
+
+def _gt3x_block(reader, acceleration):
+    # Same columns as load_gt3x, built for one slice of the decoded samples
+    xyz = _gt3x_xyz(reader, acceleration).astype(np.float32)
+
+    block = pd.DataFrame({'X': xyz[:, 0], 'Y': xyz[:, 1], 'Z': xyz[:, 2], 'IdleSleepMode': acceleration[:, 4] == 1},
+                         index=pd.Index(acceleration[:, 0], name='Timestamp'))
+    block['Datetime'] = pd.to_datetime(block.index, unit='s')
+    block['vector_magnitude'] = (block['X']**2 + block['Y']**2 + block['Z']**2)**0.5
+    return block
+
+
+def _gt3x_signal(reader, acceleration):
+    # Same samples as _gt3x_block, packed into a RawSignal
+    values = np.empty((len(acceleration), 4), dtype=np.float32)
+    values[:, :3] = _gt3x_xyz(reader, acceleration)
+    values[:, 3] = np.sqrt((values[:, :3]**2).sum(axis=1))
+    return RawSignal.from_timestamps(values, acceleration[:, 0], reader.info.sample_rate)
+
+
+def _iter_segment_pieces(reader, chunks):
+    # (start, xyz) pieces for resample_stream_blocks, split wherever samples are not 1/hz apart
+    step = 1 / reader.info.sample_rate
+    last_time = None
+    for acceleration in chunks:
+        if not len(acceleration):
+            continue
+        times = acceleration[:, 0]
+        previous = np.concatenate(([np.nan if last_time is None else last_time], times[:-1]))
+        starts = np.flatnonzero(~(np.abs(times - previous - step) <= step / 2))
+        start_times = pd.to_datetime(times[starts], unit='s').to_numpy()
+        offsets = np.append(starts, len(acceleration))
+        if offsets[0] > 0:
+            yield None, _gt3x_xyz(reader, acceleration[:offsets[0]])
+        for start_time, start, stop in zip(start_times, offsets[:-1], offsets[1:]):
+            yield start_time, _gt3x_xyz(reader, acceleration[start:stop])
+        last_time = times[-1]
+
+
+def _iter_sample_blocks(chunks, block_size):
+    # Regroups the decoded chunks into blocks of block_size samples
+    pending = []
+    n_pending = 0
+    for acceleration in chunks:
+        pending.append(acceleration)
+        n_pending += len(acceleration)
+        while n_pending >= block_size:
+            samples = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield samples[:block_size]
+            pending = [samples[block_size:]]
+            n_pending -= block_size
+    if n_pending:
+        yield np.concatenate(pending)
+
+
+def _estimated_length(reader):
+    # Samples between the start date and the last sample time of info.txt (in 100 ns ticks)
+    info = reader.info
+    if not info.start_date or info.last_sample_time <= info.start_date:
+        return None
+    return int((info.last_sample_time - info.start_date) / 10**7 * info.sample_rate)
+
+
+def load_gt3x_signal(path, target_hz=None):
+    blocks = list(iter_gt3x_blocks(path, as_signal=True, target_hz=target_hz))
+    if not blocks:
+        return RawSignal(np.empty((0, 4)), np.datetime64("NaT", "ns"), target_hz or gt3x_sample_rate(path))
+    return RawSignal.concatenate(blocks)
+
+
+def gt3x_sample_rate(path):
+    with open_gt3x(path) as reader:
+        return reader.info.sample_rate
+
+
+def iter_gt3x_blocks(path, block_seconds=3600, epoch=5, as_signal=False, target_hz=None, on_length=None):
+    """
+    Yields the recording as consecutive DataFrames of about block_seconds each.
+
+    Blocks hold a whole number of epochs and have the same columns as
+    load_gt3x. The activity log is decoded incrementally (see
+    utils.gt3x_log.iter_acceleration), so only about an hour of samples is
+    held in memory, however long the recording. With as_signal, blocks are
+    RawSignals.
+
+    With target_hz, recordings made at another sample rate are resampled to
+    target_hz one block at a time (see utils.resample). Resampled DataFrame
+    blocks have no IdleSleepMode column.
+
+    on_length is an optional callable receiving the number of samples the
+    blocks will hold in total, estimated from the start and last sample
+    times in the file's info.txt, before the first block. It is not called
+    when the file does not give these times.
+    """
+    with open_gt3x(path) as reader:
+        hz = reader.info.sample_rate
+        chunks = iter_acceleration(reader, chunk_seconds=block_seconds)
+        length = _estimated_length(reader)
+        if on_length is not None and length is not None:
+            on_length(length if target_hz is None else -(-length * target_hz // hz))
+        if target_hz is not None and hz != target_hz:
+            block_size = max(1, block_seconds // epoch) * epoch*target_hz
+            for signal in resample_stream_blocks(_iter_segment_pieces(reader, chunks), hz, target_hz, block_size):
+                yield signal if as_signal else signal.to_dataframe()
+            return
+
+        group_size = epoch*hz
+        block_size = max(1, block_seconds // epoch) * group_size
+        for acceleration in _iter_sample_blocks(chunks, block_size):
+            if as_signal:
+                yield _gt3x_signal(reader, acceleration)
+            else:
+                yield _gt3x_block(reader, acceleration)
+
+
+def load_raw_accel_file(path, as_signal=False, target_hz=None):
+    if as_signal or target_hz is not None:
+        signal = load_gt3x_signal(path, target_hz=target_hz)
+        return signal if as_signal else signal.to_dataframe()
+    return load_gt3x(path)
+
+
+def iter_signal_blocks(signal, block_seconds=3600, epoch=5):
+    # Consecutive block views of a RawSignal, sized like the blocks of iter_gt3x_blocks
+    block_size = max(1, block_seconds // epoch) * epoch*signal.hz
+    for start in range(0, len(signal), block_size):
+        yield signal.slice(start, start+block_size)
+
+
+def _iter_cached_blocks(path, signal_cache, block_seconds, epoch, as_signal, target_hz, on_length):
+    key = signal_cache.key(path, target_hz)
+    signal = signal_cache.load(key)
+    if signal is not None:
+        if on_length is not None:
+            on_length(len(signal))
+        blocks = iter_signal_blocks(signal, block_seconds=block_seconds, epoch=epoch)
+    else:
+        blocks = signal_cache.store_blocks(key, iter_gt3x_blocks(path, block_seconds=block_seconds, epoch=epoch, as_signal=True, target_hz=target_hz,
+                                                                 on_length=on_length))
+
+    for block in blocks:
+        yield block if as_signal else block.to_dataframe()
+
+
+def iter_raw_accel_blocks(path, block_seconds=3600, epoch=5, as_signal=False, target_hz=None, signal_cache=None, on_length=None):
+    """
+    Yields the recording in blocks (see iter_gt3x_blocks).
+
+    With a SignalCache, a recording decoded before is read from its memory-mapped
+    cache entry instead of the .gt3x file, and otherwise saved there while it is decoded.
+    """
+    if signal_cache is not None:
+        return _iter_cached_blocks(path, signal_cache, block_seconds, epoch, as_signal, target_hz, on_length)
+    return iter_gt3x_blocks(path, block_seconds=block_seconds, epoch=epoch, as_signal=as_signal, target_hz=target_hz, on_length=on_length)
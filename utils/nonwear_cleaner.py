@@ -1,78 +1,299 @@
 import os
 import pandas as pd
 import numpy as np
-from itertools import groupby
+from utils.raw_signal import RawSignal
+from utils.writers import append_csv
 
 
 
-def process_nonwear_times(data, nonwear_method, logbook_file, output_folder, studyid):
+def load_logbook(logbook_file):
     """
-    Processes non-wear detection based on the selected method.
-
-    Parameters:
-        - data: DataFrame containing raw accelerometer data.
-        - selected_data: Dictionary with the selected non-wear method.
-        - output_folder: Path to save the output CSVs.
-        - studyid: Identifier for the participant.
+    Reads the logbook once and indexes its rows by studyid.
 
     Returns:
-        - daily_summary: DataFrame with daily wear and non-wear durations.
-        - trimmed_data: DataFrame with only wear time data.
+        - Dictionary mapping each studyid to its wear time rows.
     """
-    non_wear_method = nonwear_method
-    logbook_file = logbook_file
-    wear_time_csv_path = os.path.join(output_folder, "all_wear_times.csv")
+    logbook_df = pd.read_csv(logbook_file, parse_dates=["WearTimeStart", "WearTimeEnd"])
+    logbook_df["studyid"] = logbook_df["studyid"].astype(str)
+    logbook = {studyid: rows.reset_index(drop=True) for studyid, rows in logbook_df.groupby("studyid", sort=False)}
+    logbook[None] = logbook_df.iloc[0:0]  # Rows returned for participants missing from the logbook
+    return logbook
 
-    if os.path.exists(wear_time_csv_path):
-        all_wear_times_df = pd.read_csv(wear_time_csv_path, parse_dates=["WearTimeStart", "WearTimeEnd"])
-    else:
-        all_wear_times_df = None
 
-    
-    if non_wear_method == "Logbook":
+def get_wear_times(nonwear_method, logbook_file, studyid, logbook=None):
+    """
+    Returns the wear times of one participant, or None when the data is not trimmed.
+
+    Pass the result of load_logbook as logbook to avoid reading the logbook
+    file again for every participant.
+    """
+    if nonwear_method == "Logbook":
+        if logbook is not None:
+            return logbook.get(studyid, logbook[None]).copy()
         if logbook_file and os.path.exists(logbook_file):
             logbook_df = pd.read_csv(logbook_file, parse_dates=["WearTimeStart", "WearTimeEnd"])
-            wear_time_df = logbook_df[logbook_df["studyid"] == studyid].copy()
-        else:
-            return None, data  # No processing, return raw data
+            logbook_df["studyid"] = logbook_df["studyid"].astype(str)
+            return logbook_df[logbook_df["studyid"] == str(studyid)].copy()
 
-    else:
-        return None, data  # No changes to raw data
+    return None
 
 
-    # Append to the all-study wear time dataset
-    if all_wear_times_df is None:
-        all_wear_times_df = wear_time_df
-    else:
-        all_wear_times_df = pd.concat([all_wear_times_df, wear_time_df], ignore_index=True)
-
+def summarize_wear_times(wear_time_df):
+    """
+    Returns the daily wear and non-wear durations (minutes) of wear windows.
 
-    # Save the updated wear times for all participants
-    all_wear_times_df.to_csv(wear_time_csv_path, index=False)
+    A window that spans midnight, e.g. a detected window covering several
+    days of continuous wear, is split at each midnight so that every day is
+    charged only with its own part.
+    """
+    windows = wear_time_df.reset_index(drop=True)
+    first_day = windows["WearTimeStart"].dt.normalize()
+    n_days = ((windows["WearTimeEnd"].dt.normalize() - first_day).dt.days + 1).clip(lower=1)
 
-    # Compute daily wear and non-wear durations
-    wear_time_summary = wear_time_df.copy()
-    wear_time_summary["WearDuration"] = (wear_time_summary["WearTimeEnd"] - wear_time_summary["WearTimeStart"]).dt.total_seconds() / 60
-    wear_time_summary["Date"] = wear_time_summary["WearTimeStart"].dt.date
+    # One row per window and calendar day it covers
+    repeat = windows.index.repeat(n_days)
+    wear_time_summary = windows.loc[repeat, ["studyid"]].reset_index(drop=True)
+    day = first_day[repeat].reset_index(drop=True) + pd.to_timedelta(wear_time_summary.groupby(repeat).cumcount().to_numpy(), unit="D")
+    start = windows.loc[repeat, "WearTimeStart"].reset_index(drop=True).clip(lower=day)
+    end = windows.loc[repeat, "WearTimeEnd"].reset_index(drop=True).clip(upper=day + pd.Timedelta(days=1))
+    wear_time_summary["WearDuration"] = (end - start).dt.total_seconds() / 60
+    wear_time_summary["Date"] = day.dt.date
 
     daily_summary = wear_time_summary.groupby(["studyid", "Date"]).agg({"WearDuration": "sum"}).reset_index()
     daily_summary["NonWearDuration"] = 1440 - daily_summary["WearDuration"]
 
-    summary_csv_path = os.path.join(output_folder, "wear_daily_summary.csv")
-    if os.path.exists(summary_csv_path):
-        existing_summary = pd.read_csv(summary_csv_path)
-        daily_summary = pd.concat([existing_summary, daily_summary], ignore_index=True)
-    
-    daily_summary.to_csv(summary_csv_path, index=False)
-
-    # Trim raw data based on wear time
-    trimmed_data = pd.DataFrame()
-    
-    for _, row in wear_time_df.iterrows():
-        mask = (data["Datetime"] >= row["WearTimeStart"]) & (data["Datetime"] <= row["WearTimeEnd"])
-        trimmed_data = pd.concat([trimmed_data, data[mask]])
+    return daily_summary
+
+
+def merge_wear_windows(wear_time_df):
+    """
+    Returns the wear windows as sorted start and end arrays, with
+    overlapping or touching windows merged into one.
+    """
+    starts = wear_time_df["WearTimeStart"].to_numpy(dtype="datetime64[ns]")
+    ends = wear_time_df["WearTimeEnd"].to_numpy(dtype="datetime64[ns]")
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    if len(starts) == 0:
+        return starts, ends
+
+    # A window opens a new interval when it starts after every earlier window has ended
+    latest_end = np.maximum.accumulate(ends)
+    new_interval = np.concatenate(([True], starts[1:] > latest_end[:-1]))
+    # and an interval ends at the running maximum just before the next one opens
+    last_window = np.append(new_interval[1:], True)
+    return starts[new_interval], latest_end[last_window]
+
+
+def trim_to_wear_times(data, wear_time_df):
+    # Trim raw data based on wear time, using binary search on the time-ordered samples
+    starts, ends = merge_wear_windows(wear_time_df)
+
+    if isinstance(data, RawSignal):
+        first = data.searchsorted(starts, side="left")
+        last = data.searchsorted(ends, side="right")
+        return RawSignal.concatenate([data.slice(0, 0)] + [data.slice(start, stop) for start, stop in zip(first, last)])
+
+    datetimes = data["Datetime"].to_numpy(dtype="datetime64[ns]")
+    first = np.searchsorted(datetimes, starts, side="left")
+    last = np.searchsorted(datetimes, ends, side="right")
+    slices = [data.iloc[start:stop] for start, stop in zip(first, last) if stop > start]
+    if len(slices) == 1:
+        return slices[0]
+    if not slices:
+        return data.iloc[0:0]
+    return pd.concat(slices)
+
+
+def iter_trimmed_blocks(blocks, wear_time_df, writer=None):
+    """
+    Trims a stream of raw data blocks to the wear times.
+
+    Each trimmed block is yielded when it still holds samples, and passed to
+    writer (a TableWriter for the trimmed data file) when one is given.
+    """
+    for block in blocks:
+        trimmed_block = trim_to_wear_times(block, wear_time_df)
+        if len(trimmed_block):
+            if writer is not None:
+                writer.write(trimmed_block.to_dataframe() if isinstance(trimmed_block, RawSignal) else trimmed_block)
+            yield trimmed_block
+
+
+def _step_statistics(timestamps, xyz, step_ns):
+    # Per-axis sums, sums of squares, minima and maxima of each step, for time-ordered samples
+    keys = timestamps // step_ns
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.append(starts[1:], len(keys))
+    return {
+        "key": keys[starts],
+        "count": ends - starts,
+        "sum": np.add.reduceat(xyz, starts),
+        "sumsq": np.add.reduceat(xyz * xyz, starts),
+        "min": np.minimum.reduceat(xyz, starts),
+        "max": np.maximum.reduceat(xyz, starts),
+        "first": timestamps[starts],
+        "last": timestamps[ends - 1],
+    }
+
+
+def _combine_step_statistics(stats):
+    # Merges steps split across block boundaries
+    combined = {name: np.concatenate([block[name] for block in stats]) for name in stats[0]}
+    keys = combined["key"]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    return {
+        "key": keys[starts],
+        "count": np.add.reduceat(combined["count"], starts),
+        "sum": np.add.reduceat(combined["sum"], starts),
+        "sumsq": np.add.reduceat(combined["sumsq"], starts),
+        "min": np.minimum.reduceat(combined["min"], starts),
+        "max": np.maximum.reduceat(combined["max"], starts),
+        "first": np.minimum.reduceat(combined["first"], starts),
+        "last": np.maximum.reduceat(combined["last"], starts),
+    }
+
+
+def detect_wear_times(blocks, studyid, window_minutes=60, step_minutes=15, sd_threshold=0.013, range_threshold=0.05, min_axes=2):
+    """
+    Detects wear time from the accelerometer signal itself.
+
+    The recording is split into steps of step_minutes, and windows of
+    window_minutes slide over it one step at a time. An axis is still in a
+    window when its standard deviation is below sd_threshold and its range
+    below range_threshold (both in g). Every step covered by a window with
+    at least min_axes still axes is non-wear. Only small per-step totals are
+    kept, so the blocks are streamed.
+
+    Parameters:
+        - blocks: Iterable of time-ordered RawSignal or DataFrame blocks.
+        - studyid: Identifier for the participant.
+
+    Returns:
+        - DataFrame with studyid, WearTimeStart and WearTimeEnd, in the same
+          format as the logbook rows.
+    """
+    step_ns = step_minutes * 60 * 10**9
+    window_steps = max(1, window_minutes // step_minutes)
+
+    stats = []
+    for block in blocks:
+        if not len(block):
+            continue
+        if isinstance(block, RawSignal):
+            timestamps = block.timestamps().astype(np.int64)
+            xyz = block.values[:, :3].astype(np.float64)
+        else:
+            timestamps = block["Datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+            xyz = block[["X", "Y", "Z"]].to_numpy(dtype=np.float64)
+        stats.append(_step_statistics(timestamps, xyz, step_ns))
+
+    if not stats:
+        return pd.DataFrame({"studyid": pd.Series(dtype=str),
+                             "WearTimeStart": pd.Series(dtype="datetime64[ns]"),
+                             "WearTimeEnd": pd.Series(dtype="datetime64[ns]")})
+    stats = _combine_step_statistics(stats)
+
+    # Steps laid out on a regular grid, with empty steps where the recording has gaps
+    position = stats["key"] - stats["key"][0]
+    n_steps = max(position[-1] + 1, window_steps)
+    count = np.zeros(n_steps)
+    sums = np.zeros((n_steps, 3))
+    sumsq = np.zeros((n_steps, 3))
+    mins = np.full((n_steps, 3), np.inf)
+    maxs = np.full((n_steps, 3), -np.inf)
+    count[position] = stats["count"]
+    sums[position] = stats["sum"]
+    sumsq[position] = stats["sumsq"]
+    mins[position] = stats["min"]
+    maxs[position] = stats["max"]
+
+    # Window totals from running sums, window extremes from strided views
+    def window_sum(values):
+        running = np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)))
+        return running[window_steps:] - running[:-window_steps]
+
+    window_count = window_sum(count)[:, None]
+    window_sum_xyz = window_sum(sums)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (window_sum(sumsq) - window_sum_xyz**2 / window_count) / (window_count - 1)
+    window_range = (np.lib.stride_tricks.sliding_window_view(maxs, window_steps, axis=0).max(axis=2)
+                    - np.lib.stride_tricks.sliding_window_view(mins, window_steps, axis=0).min(axis=2))
+    still_axes = ((np.sqrt(np.maximum(variance, 0)) < sd_threshold) & (window_range < range_threshold)).sum(axis=1)
+    nonwear_windows = np.flatnonzero((still_axes >= min_axes) & (window_count[:, 0] > 1))
+
+    # Mark every step covered by a non-wear window
+    covered = np.zeros(n_steps + 1, dtype=np.int64)
+    np.add.at(covered, nonwear_windows, 1)
+    np.add.at(covered, nonwear_windows + window_steps, -1)
+    nonwear = np.cumsum(covered[:-1]) > 0
+
+    wear = np.zeros(n_steps, dtype=bool)
+    wear[position] = ~nonwear[position]
+    first = np.zeros(n_steps, dtype=np.int64)
+    last = np.zeros(n_steps, dtype=np.int64)
+    first[position] = stats["first"]
+    last[position] = stats["last"]
+
+    # Consecutive wear steps become one wear window, bounded by its first and last samples
+    edges = np.diff(np.concatenate(([False], wear, [False])).astype(np.int8))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1) - 1
+    return pd.DataFrame({
+        "studyid": studyid,
+        "WearTimeStart": first[run_starts].astype("datetime64[ns]"),
+        "WearTimeEnd": last[run_ends].astype("datetime64[ns]"),
+    })
+
+
+def process_nonwear_times(data, nonwear_method, logbook_file, output_folder, studyid):
+    """
+    Processes non-wear detection based on the selected method.
+
+    Parameters:
+        - data: DataFrame or RawSignal containing raw accelerometer data.
+        - nonwear_method: "Logbook", "Accelerometer" (see detect_wear_times) or anything else for no trimming.
+        - logbook_file: Path to the logbook CSV, used with the Logbook method.
+        - output_folder: Path to save the output CSVs.
+        - studyid: Identifier for the participant.
+
+    Returns:
+        - daily_summary: DataFrame with daily wear and non-wear durations.
+        - trimmed_data: Data of the same type with only wear time data.
+        - wear_time_df: DataFrame with the wear times used to trim the data.
+
+    The all-participant outputs are written separately by save_wear_times so
+    that a single process owns them when participants run in parallel.
+    """
+    if nonwear_method == "Accelerometer":
+        wear_time_df = detect_wear_times([data], studyid)
+    else:
+        wear_time_df = get_wear_times(nonwear_method, logbook_file, studyid)
+    if wear_time_df is None:
+        return None, data, None  # No changes to raw data
+
+    daily_summary = summarize_wear_times(wear_time_df)
+    trimmed_data = trim_to_wear_times(data, wear_time_df)
 
     trimmed_data_csv_path = os.path.join(output_folder, f"{studyid}_trimmed_data.csv")
-    trimmed_data.to_csv(trimmed_data_csv_path, index=False)
+    trimmed_data_df = trimmed_data.to_dataframe() if isinstance(trimmed_data, RawSignal) else trimmed_data
+    trimmed_data_df.to_csv(trimmed_data_csv_path, index=False)
 
-    return daily_summary, trimmed_data
\ No newline at end of file
+    return daily_summary, trimmed_data, wear_time_df
+
+
+def save_wear_times(output_folder, wear_time_df, daily_summary):
+    """
+    Appends one participant's wear times and daily wear summary to the
+    all-participant outputs (see utils.writers.append_csv).
+
+    Parameters:
+        - output_folder: Path to save the output CSVs.
+        - wear_time_df: Wear times returned by process_nonwear_times.
+        - daily_summary: Daily summary returned by process_nonwear_times.
+    """
+    wear_time_csv_path = os.path.join(output_folder, "all_wear_times.csv")
+    append_csv(wear_time_csv_path, wear_time_df)
+
+    summary_csv_path = os.path.join(output_folder, "wear_daily_summary.csv")
+    append_csv(summary_csv_path, daily_summary)
@@ -0,0 +1,564 @@
+import io
+import os
+import time
+import signal
+import multiprocessing
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from os import path
+from queue import Empty
+import pandas as pd
+from utils.loader import iter_raw_accel_blocks
+from utils.feature_extraction import iter_features_with_start_times
+from utils.classifier import load_xgboost_classifier, predict_labels, get_label_encoder
+from utils.summarizer import count_predictions, daily_summary, hourly_summary, weekday_summary, bout_summary, merge_summary_files
+from utils.nonwear_cleaner import load_logbook, get_wear_times, detect_wear_times, summarize_wear_times, iter_trimmed_blocks, save_wear_times
+from utils.feature_cache import FeatureCache
+from utils.signal_cache import SignalCache
+from utils.run_manifest import load_manifest, save_manifest, participant_fingerprint, is_unchanged, load_checkpoint, save_checkpoint, remove_checkpoint
+from utils.config import outcome_models, model_folder_variable, model_epoch, model_hz, bout_minutes, bout_tolerance_minutes, bout_min_share, wear_detection
+from utils.writers import TableWriter, append_csv, write_csv, output_formats
+from utils.profiler import StageProfiler, save_report
+from utils.progress import FileProgress, RunProgress
+
+# Shared output file of each optional summary breakdown
+breakdown_files = {"hourly": "by_hour_by_participants.csv", "weekday": "by_weekday_weekend_by_participants.csv",
+                   "bouts": "bouts_by_day_by_participants.csv"}
+
+# Models already loaded in this process, keyed by outcome
+_loaded_models = {}
+
+# Queue used by pool workers to send progress messages back to the parent,
+# and event the parent sets to cancel the participants they are processing
+_progress_queue = None
+_cancel_event = None
+
+
+class RunCancelled(Exception):
+    """
+    Raised within a run when it was asked to stop.
+    """
+
+
+def _until_stopped(blocks, should_stop):
+    # Checked between blocks, so a run stops within one block of data of being cancelled
+    for block in blocks:
+        if should_stop():
+            raise RunCancelled()
+        yield block
+
+
+def get_relative_path(relpath):
+    return path.abspath(path.join(path.dirname(__file__), "..", relpath))
+
+
+def get_model_path(outcome):
+    model_folder = os.environ.get(model_folder_variable)
+    if model_folder:
+        return path.join(model_folder, path.basename(outcome_models[outcome][0]))
+    return get_relative_path(outcome_models[outcome][0])
+
+
+def load_outcome_model(outcome):
+    # The Booster is kept so that every participant scored in this process reuses it
+    if outcome not in _loaded_models:
+        model = load_xgboost_classifier(get_model_path(outcome)).get_booster()
+        label_classes = outcome_models[outcome][1]
+        _loaded_models[outcome] = (model, get_label_encoder(label_classes))
+
+    return _loaded_models[outcome]
+
+
+def selected_outcomes(selectedData):
+    # "outcome" is the name of one outcome model or a list of them
+    outcome = selectedData.get("outcome")
+    if outcome is None or isinstance(outcome, str):
+        return [outcome]
+    return list(outcome)
+
+
+def combine_predictions(predictions):
+    """
+    Joins the predict_labels results of several models into one frame.
+
+    With a single model its result is returned unchanged. Otherwise the
+    frame has one Time column and each model's columns prefixed with its
+    outcome name (e.g. "NVM_TPA_SED_Prediction").
+    """
+    if len(predictions) == 1:
+        return next(iter(predictions.values()))
+
+    frames = [frame.drop(columns='Time').add_prefix(outcome + "_") for outcome, frame in predictions.items()]
+    return pd.concat([next(iter(predictions.values()))[['Time']]] + frames, axis=1)
+
+
+def summarize_outcome(predicted_labels, classes, selectedData):
+    """
+    Returns the by-day summary and the selected breakdowns of one model's predictions.
+    """
+    prediction_data = pd.concat(predicted_labels) if predicted_labels else pd.DataFrame({'Time': [], 'Prediction': []})
+    # All of the model's labels get a column so the rows of every participant line up when appended
+    counts = count_predictions(prediction_data, classes=classes)
+    # With overlapping windows each prediction stands for one hop of time
+    seconds = selectedData.get("hop_seconds") or model_epoch
+    summaries = {"summary": daily_summary(*counts, epoch=seconds)}
+    if selectedData.get("hourly_summary"):
+        summaries["hourly"] = hourly_summary(*counts, epoch=seconds)
+    if selectedData.get("weekday_summary"):
+        summaries["weekday"] = weekday_summary(*counts, epoch=seconds)
+    if selectedData.get("bout_summary"):
+        summaries["bouts"] = bout_summary(prediction_data, classes, epoch=seconds,
+                                          bout_minutes=selectedData.get("bout_minutes") or bout_minutes,
+                                          tolerance_minutes=selectedData.get("bout_tolerance_minutes", bout_tolerance_minutes),
+                                          min_share=selectedData.get("bout_min_share", bout_min_share))
+    return summaries
+
+
+def combine_summaries(summaries):
+    """
+    Joins the summarize_outcome results of several models, with each model's
+    label columns prefixed with its outcome name (e.g. "NVM_LPA_MVPA_SED_MVPA").
+    """
+    if len(summaries) == 1:
+        return next(iter(summaries.values()))
+
+    keys = {"hourly": ['Date', 'Hour'], "weekday": ['DayType', 'Days'], "bouts": ['Date']}
+    combined = {}
+    for breakdown in next(iter(summaries.values())):
+        frames = []
+        for outcome, outcome_summaries in summaries.items():
+            frame = outcome_summaries[breakdown]
+            labels = frame.columns.drop(keys.get(breakdown, []))
+            frames.append(frame.rename(columns={label: f"{outcome}_{label}" for label in labels}))
+        if breakdown == "summary":
+            combined[breakdown] = pd.concat(frames, axis=1)
+        else:
+            combined[breakdown] = reduce(lambda left, right: left.merge(right, on=keys[breakdown], how='outer'), frames)
+    return combined
+
+
+def list_gt3x_files(gt3x_folder):
+    return [filename for filename in os.listdir(gt3x_folder)
+            if os.path.isfile(os.path.join(gt3x_folder, filename)) and filename.endswith(".gt3x")]
+
+
+def process_participant(file_path, selectedData, wear_time_df, progress=None, should_stop=None):
+    """
+    Runs load, nonwear removal, feature extraction, prediction and summary for one .gt3x file.
+
+    Parameters:
+        - file_path: Path to the .gt3x file.
+        - selectedData: Dictionary with the user selections. "output_format"
+          ("csv", "parquet" or "feather") sets the format of the per-file
+          outputs. "save_trimmed_data" and "save_predictions" (both default
+          True) turn those files off, and "slim_predictions" writes only
+          Time, Prediction and the class probabilities instead of the features.
+          "hourly_summary" and "weekday_summary" add the hourly and
+          weekday/weekend breakdowns, and "bout_summary" the daily bouts
+          (of at least "bout_minutes", with interruptions of up to
+          "bout_tolerance_minutes" and at least "bout_min_share" of the
+          epochs in the bout's labels), sedentary breaks and transitions. "outcome" is one outcome name or a
+          list of them. Several models all score the features extracted
+          once, and their columns are prefixed with the outcome name in the
+          predictions and summaries. With "signal_cache_folder", decoded
+          recordings are kept there and read back with np.memmap (see
+          utils.signal_cache). "hop_seconds" scores overlapping epoch-length
+          windows starting every hop_seconds instead of consecutive epochs.
+        - wear_time_df: The participant's wear times from get_wear_times, or
+          None to use the whole recording. With the "Accelerometer" non-wear
+          method the wear times are detected from the recording instead.
+        - progress: Optional callable receiving (status, fraction of the file
+          done, details). Besides the stage changes it is called at most every
+          "progress_interval" seconds (default 1) during loading, feature
+          extraction and prediction, with the epochs per second and the time
+          left (see utils.progress.FileProgress).
+        - should_stop: Optional callable returning True once the run is
+          cancelled. It is checked between blocks, and RunCancelled is raised
+          without writing any of the participant's outputs.
+
+    Returns:
+        - Dictionary with the studyid, the by-day summary, the optional
+          "hourly", "weekday" and "bouts" breakdowns and the wear times (None when no
+          logbook was used) for the shared output files, and the stage
+          timings of this file under "profile".
+    """
+    should_stop = should_stop or (lambda: False)
+    file_progress = FileProgress(progress or (lambda status, fraction, details: None),
+                                 passes=2 if selectedData['non_wear_method'] == "Accelerometer" else 1,
+                                 interval=selectedData.get("progress_interval", 1.0))
+    profiler = StageProfiler()
+    filename = os.path.basename(file_path)
+    studyid = os.path.splitext(filename)[0]
+    output_folder = selectedData['output_folder']
+    outcomes = selected_outcomes(selectedData)
+    models = {outcome: load_outcome_model(outcome) for outcome in outcomes}
+
+    signal_cache = None
+    if selectedData.get("signal_cache_folder"):
+        signal_cache = SignalCache(selectedData["signal_cache_folder"], max_bytes=selectedData.get("signal_cache_max_bytes", 20 * 1024**3))
+
+    output_format = selectedData.get("output_format", "csv")
+    detects_wear = selectedData['non_wear_method'] == "Accelerometer"
+    # Cached features skip trimming, so they are only used when the trimmed data file is not needed or already saved
+    trimmed_path = os.path.join(output_folder, f"{studyid}_trimmed_data" + output_formats[output_format])
+    trimmed_missing = selectedData.get("save_trimmed_data", True) and not os.path.exists(trimmed_path)
+
+    cache = None
+    cached = None
+    if selectedData.get("cache_folder"):
+        cache = FeatureCache(selectedData["cache_folder"], max_bytes=selectedData.get("cache_max_bytes", 5 * 1024**3))
+        if detects_wear:
+            # Detected wear times only depend on the recording, so a hit also skips the detection pass
+            cache_key = cache.key(file_path, None, epoch=model_epoch, hz=model_hz, hop=selectedData.get("hop_seconds"), wear_detection=wear_detection)
+            if not trimmed_missing:
+                with profiler.stage("feature_cache"):
+                    wear_time_df = cache.load_wear_times(cache_key, studyid)
+                    if wear_time_df is not None:
+                        cached = cache.load(cache_key)
+
+    if detects_wear and cached is None:
+        file_progress.status("Detecting nonwear for " + filename + "...")
+        blocks = profiler.iter_stage("load_raw_accel_file", iter_raw_accel_blocks(file_path, block_seconds=selectedData.get("block_seconds", 3600), as_signal=True, target_hz=model_hz,
+                                                                                  signal_cache=signal_cache, on_length=file_progress.set_total), samples=len)
+        with profiler.stage("detect_wear_times"):
+            wear_time_df = detect_wear_times(_until_stopped(file_progress.iter_blocks(blocks), should_stop), studyid, **wear_detection)
+        file_progress.next_pass()
+
+    wear_summary = None
+    if wear_time_df is not None:
+        wear_summary = summarize_wear_times(wear_time_df)
+
+    slim_predictions = selectedData.get("slim_predictions", False)
+    trimmed_writer = None
+    predictions_writer = None
+    if selectedData.get("save_predictions", True):
+        predictions_writer = TableWriter(os.path.join(output_folder, filename + "_predictions"), output_format, index=not slim_predictions)
+
+    if cache is not None and not detects_wear:
+        cache_key = cache.key(file_path, wear_time_df, epoch=model_epoch, hz=model_hz, hop=selectedData.get("hop_seconds"))
+        if not (wear_time_df is not None and trimmed_missing):
+            with profiler.stage("feature_cache"):
+                cached = cache.load(cache_key)
+
+    if cached is not None:
+        # Features from an earlier run with the same recording and wear times
+        file_progress.status("Using cached features for " + filename + "...")
+        profiler.count("feature_cache", epochs=len(cached[0]))
+        feature_blocks = [cached]
+    else:
+        # The recording is streamed one block at a time through trimming, feature extraction and prediction
+        blocks = profiler.iter_stage("load_raw_accel_file", iter_raw_accel_blocks(file_path, block_seconds=selectedData.get("block_seconds", 3600), as_signal=True, target_hz=model_hz,
+                                                                                  signal_cache=signal_cache, on_length=file_progress.set_total), samples=len)
+        blocks = file_progress.iter_blocks(blocks)
+        if wear_time_df is not None:
+            file_progress.status("Removing nonwear for " + filename + "...")
+            if selectedData.get("save_trimmed_data", True):
+                trimmed_writer = TableWriter(os.path.join(output_folder, f"{studyid}_trimmed_data"), output_format)
+            blocks = profiler.iter_stage("process_nonwear_times", iter_trimmed_blocks(blocks, wear_time_df, trimmed_writer), samples=len)
+
+        file_progress.status("Extracting features for " + filename + "...")
+        feature_blocks = profiler.iter_stage("extract_features_with_start_times",
+                                             iter_features_with_start_times(blocks, epoch=model_epoch, hz=model_hz, n_jobs=selectedData.get("feature_jobs", 1),
+                                                                            hop=selectedData.get("hop_seconds")),
+                                             epochs=lambda block: len(block[0]))
+        if cache is not None:
+            feature_blocks = cache.store_blocks(cache_key, feature_blocks, wear_time_df=wear_time_df if detects_wear else None)
+
+    predicted_labels = {outcome: [] for outcome in models}
+    writers = [writer for writer in (trimmed_writer, predictions_writer) if writer is not None]
+    try:
+        for features, start_times in _until_stopped(feature_blocks, should_stop):
+            with profiler.stage("predict", epochs=len(features)):
+                # Every selected model scores the same features
+                predictions = {outcome: predict_labels(model, features, start_times, label_encoder, probabilities=slim_predictions)
+                               for outcome, (model, label_encoder) in models.items()}
+                combined = combine_predictions(predictions)
+            with profiler.stage("write_predictions", epochs=len(features)):
+                if predictions_writer is not None and slim_predictions:
+                    predictions_writer.write(combined)
+                elif predictions_writer is not None:
+                    for column in combined.columns.drop('Time'):
+                        features[column] = combined[column]
+                    features['Time'] = combined['Time']
+                    predictions_writer.write(features)
+            del features  # Only the labels are kept for the summary
+            for outcome, outcome_predictions in predictions.items():
+                predicted_labels[outcome].append(outcome_predictions[['Time', 'Prediction']])
+            file_progress.add_epochs(len(start_times))
+    except BaseException:
+        # A cancelled or failed file leaves its earlier outputs untouched
+        for writer in writers:
+            writer.discard()
+        raise
+    for writer in writers:
+        writer.close()
+
+    file_progress.finish()
+    file_progress.status("Features extracted for " + filename)
+    file_progress.status("File " + filename + " successfully predicted!")
+
+    n_epochs = sum(len(labels) for labels in predicted_labels[outcomes[0]])
+    with profiler.stage("summarize_predictions", epochs=n_epochs * len(outcomes)):
+        summaries = {outcome: summarize_outcome(predicted_labels[outcome], models[outcome][1].classes_, selectedData)
+                     for outcome in outcomes}
+        summaries = combine_summaries(summaries)
+        summary = summaries.pop("summary")
+        summary['studyid'] = studyid
+        breakdowns = {breakdown: frame.assign(studyid=studyid) for breakdown, frame in summaries.items()}
+
+    profile = dict(profiler.report(), studyid=studyid, file=filename,
+                   epochs=n_epochs)
+    return dict(breakdowns, studyid=studyid, summary=summary, daily_summary=wear_summary, wear_time_df=wear_time_df, profile=profile)
+
+
+def save_participant_outputs(output_folder, result):
+    # Only the parent process calls this, so the shared CSVs have a single writer
+    if result["wear_time_df"] is not None:
+        save_wear_times(output_folder, result["wear_time_df"], result["daily_summary"])
+
+    if len(result["summary"]):
+        append_csv(os.path.join(output_folder, "by_day_by_participants.csv"), result["summary"].reset_index())
+
+    for breakdown, filename in breakdown_files.items():
+        if breakdown in result and len(result[breakdown]):
+            append_csv(os.path.join(output_folder, filename), result[breakdown])
+
+
+def _read_complete_rows(csv_path):
+    # A last line cut off by a crash while appending (see append_csv) is dropped
+    with open(csv_path, "rb") as f:
+        content = f.read()
+    if not content.endswith(b"\n"):
+        content = content[:content.rfind(b"\n") + 1]
+    if not content:
+        return None
+    return pd.read_csv(io.BytesIO(content), dtype={"studyid": str})
+
+
+def remove_participant_rows(output_folder, studyids):
+    """
+    Drops the given participants from the all-participant outputs, so that
+    their rows can be appended again without duplicates. Each file is read
+    and written once per run.
+    """
+    for filename in ["by_day_by_participants.csv", "all_wear_times.csv", "wear_daily_summary.csv"] + list(breakdown_files.values()):
+        csv_path = os.path.join(output_folder, filename)
+        if os.path.exists(csv_path):
+            rows = _read_complete_rows(csv_path)
+            if rows is not None:
+                rows = rows[~rows["studyid"].isin(studyids)]
+            # An emptied file is started again, so that it takes the header of the new rows
+            if rows is None or rows.empty:
+                os.remove(csv_path)
+            else:
+                write_csv(csv_path, rows)
+
+
+def _init_pool_worker(progress_queue, cancel_event):
+    global _progress_queue, _cancel_event
+    _progress_queue = progress_queue
+    _cancel_event = cancel_event
+    # Ctrl+C reaches the whole process group; the parent cancels the workers through the event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _process_participant_in_pool(file_path, selectedData, wear_time_df):
+    return process_participant(file_path, selectedData, wear_time_df, should_stop=_cancel_event.is_set,
+                               progress=lambda *update: _progress_queue.put((file_path,) + update))
+
+
+def run_pipeline(selectedData, progress, should_stop=None):
+    """
+    Processes every .gt3x file in the input folder.
+
+    Parameters:
+        - selectedData: Dictionary with the user selections. "n_jobs" sets how
+          many participants are processed at once (default 1) and
+          "feature_jobs" how many threads extract features within a file
+          (default: the cores left over per participant). With
+          "incremental", participants whose file, logbook rows and settings
+          match the run manifest in the output folder are skipped. Unless
+          "resume" is False, a run that did not finish (see
+          utils.run_manifest.load_checkpoint) is resumed at its first
+          unfinished participant.
+        - progress: Callable receiving (percent, status) updates.
+        - should_stop: Optional callable returning True to cancel the run.
+          Participants being processed stop at their next block of data,
+          and the run can be resumed later.
+
+    The time, peak memory and samples/epochs of each stage of every
+    participant are written to run_report.json in the output folder.
+    Each participant's outputs are written to temporary files that replace
+    the shared CSVs and per-file outputs once complete.
+
+    A file that fails is reported and listed under "failed" in the report,
+    and the other files are still processed and saved.
+
+    Returns:
+        - True when every file was processed, False when the run was
+          cancelled, a file failed or no model was selected.
+    """
+    profiler = StageProfiler()
+    should_stop = should_stop or (lambda: False)
+    progress(0, "Loading the model...")
+
+    if not all(outcome in outcome_models for outcome in selected_outcomes(selectedData)):
+        progress(100, "Error: No model selected!")
+        return False  # Stop execution if no selection is made
+
+    n_jobs = max(1, int(selectedData.get("n_jobs") or 1))
+    if not selectedData.get("feature_jobs"):
+        selectedData = dict(selectedData, feature_jobs=max(1, (os.cpu_count() or 1) // n_jobs))
+    if n_jobs == 1:
+        # Pool workers load their own copy of the model
+        with profiler.stage("load_outcome_model"):
+            for outcome in selected_outcomes(selectedData):
+                load_outcome_model(outcome)
+    progress(100, "Model loaded successfully!")
+
+    gt3x_folder = selectedData['input_folder']
+    output_folder = selectedData['output_folder']
+    file_paths = [os.path.join(gt3x_folder, filename) for filename in list_gt3x_files(gt3x_folder)]
+
+    logbook = None
+    if selectedData['non_wear_method'] == "Logbook" and selectedData['logbook_file'] and os.path.exists(selectedData['logbook_file']):
+        logbook = load_logbook(selectedData['logbook_file'])
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {key: selectedData.get(key) for key in ("outcome", "non_wear_method", "n_jobs", "feature_jobs", "output_format", "incremental", "hop_seconds")},
+        "cpu_count": os.cpu_count(),
+        "participants": [],
+        "skipped": [],
+    }
+    report_path = os.path.join(output_folder, "run_report.json")
+
+    manifest = load_manifest(output_folder)
+    checkpoint = load_checkpoint(output_folder)
+    interrupted = set(checkpoint["pending"]) if checkpoint is not None else set()
+    fingerprints = {}
+    wear_times = {}
+    for file_path in list(file_paths):
+        studyid = os.path.splitext(os.path.basename(file_path))[0]
+        wear_times[file_path] = get_wear_times(selectedData['non_wear_method'], selectedData['logbook_file'], studyid, logbook)
+        fingerprints[studyid] = participant_fingerprint(file_path, selectedData, wear_times[file_path], manifest.get(studyid))
+        # Rows of participants a stopped run had yet to finish may already be removed
+        unchanged = is_unchanged(manifest.get(studyid), fingerprints[studyid]) and studyid not in interrupted
+        if selectedData.get("incremental") and unchanged:
+            progress(0, "Skipping unchanged " + os.path.basename(file_path))
+        elif checkpoint is not None and selectedData.get("resume", True) and unchanged:
+            progress(0, "Skipping " + os.path.basename(file_path) + ", finished before the last run stopped")
+        else:
+            continue
+        file_paths.remove(file_path)
+        report["skipped"].append(os.path.basename(file_path))
+    n_files = len(file_paths)
+
+    # Rows a stopped run appended for its unfinished participants are removed with the rest
+    pending = {os.path.splitext(os.path.basename(file_path))[0] for file_path in file_paths}
+    save_checkpoint(output_folder, pending)
+    remove_participant_rows(output_folder, list(pending))
+
+    def save_outputs(result):
+        with profiler.stage("save_participant_outputs"):
+            save_participant_outputs(output_folder, result)
+        manifest[result["studyid"]] = fingerprints[result["studyid"]]
+        save_manifest(output_folder, manifest)
+        pending.discard(result["studyid"])
+        save_checkpoint(output_folder, pending)
+        report["participants"].append(result["profile"])
+        save_report(report_path, dict(report, run=profiler.report()))
+
+    def save_failure(file_path, error):
+        # The participant stays in the checkpoint, so the next run retries it
+        report["failed"].append({"file": os.path.basename(file_path), "error": f"{type(error).__name__}: {error}"})
+        save_report(report_path, dict(report, run=profiler.report()))
+        run_progress.file_done(file_path, f"Error processing {os.path.basename(file_path)}: {type(error).__name__}: {error}")
+
+    # Overall percentage and time left, from the progress each participant reports
+    run_progress = RunProgress(progress, n_files)
+    report["failed"] = []
+    try:
+        if n_jobs == 1:
+            for file_path in file_paths:
+                if should_stop():
+                    raise RunCancelled()
+                try:
+                    result = process_participant(file_path, selectedData, wear_times[file_path], should_stop=should_stop,
+                                                 progress=lambda *update: run_progress.update(file_path, *update))
+                except RunCancelled:
+                    raise
+                except Exception as error:
+                    save_failure(file_path, error)
+                    continue
+                save_outputs(result)
+                run_progress.file_done(file_path, "Participant " + result["studyid"] + " saved")
+        else:
+            _run_pool(file_paths, selectedData, wear_times, n_jobs, run_progress, should_stop, save_outputs, save_failure)
+    except RunCancelled:
+        save_report(report_path, dict(report, run=profiler.report(), cancelled=time.strftime("%Y-%m-%dT%H:%M:%S")))
+        progress(round((n_files - len(pending))/max(n_files, 1)*100),
+                 f"Cancelled with {len(pending)} of {n_files} files left. Run again with the same settings to resume.")
+        return False
+
+    with profiler.stage("merge_summary_files"):
+        merge_summary_files(output_folder)
+    save_report(report_path, dict(report, run=profiler.report(), finished=time.strftime("%Y-%m-%dT%H:%M:%S")))
+    if report["failed"]:
+        failed = ", ".join(failure["file"] for failure in report["failed"])
+        progress(100, f"Finished with errors: {len(report['failed'])} of {n_files} files failed ({failed}). See run_report.json.")
+        return False
+
+    remove_checkpoint(output_folder)
+    progress(100, "Complete!")
+    return True
+
+
+def _run_pool(file_paths, selectedData, wear_times, n_jobs, run_progress, should_stop, save_outputs, save_failure):
+    # Participants are processed by worker processes and saved by this one as they finish
+    n_files = len(file_paths)
+    context = multiprocessing.get_context("spawn")
+    progress_queue = context.Queue()
+    cancel_event = context.Event()
+    with ProcessPoolExecutor(max_workers=min(n_jobs, max(1, n_files)), mp_context=context,
+                             initializer=_init_pool_worker, initargs=(progress_queue, cancel_event)) as executor:
+        futures = {executor.submit(_process_participant_in_pool, file_path, selectedData, wear_times[file_path]): file_path for file_path in file_paths}
+        pending = set(futures)
+
+        def cancel_pending():
+            # Queued participants are dropped and running ones stop at their next block
+            cancel_event.set()
+            for future in pending:
+                future.cancel()
+
+        try:
+            while pending:
+                if should_stop() and not cancel_event.is_set():
+                    cancel_pending()
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                _drain_progress(progress_queue, run_progress)
+                for future in done:
+                    if future.cancelled() or isinstance(future.exception(), RunCancelled):
+                        continue
+                    if future.exception() is not None:
+                        save_failure(futures[future], future.exception())
+                        continue
+                    save_outputs(future.result())
+                    run_progress.file_done(futures[future], "Participant " + future.result()["studyid"] + " saved")
+        except BaseException:
+            # Otherwise leaving the executor would wait for every queued participant
+            cancel_pending()
+            raise
+        _drain_progress(progress_queue, run_progress)
+
+    if cancel_event.is_set():
+        raise RunCancelled()
+
+
+def _drain_progress(progress_queue, run_progress):
+    while True:
+        try:
+            update = progress_queue.get_nowait()
+        except Empty:
+            return
+        run_progress.update(*update)
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def _windows_peak_rss():
+    # PeakWorkingSetSize from GetProcessMemoryInfo, in bytes
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                   [(name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                                                         "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                                                         "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    get_process_memory_info.restype = wintypes.BOOL
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_process_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of this process so far in MB, or None when it cannot be measured.
+    """
+    if sys.platform == "win32":
+        try:
+            peak = _windows_peak_rss()
+        except (AttributeError, OSError):
+            return None
+        return None if peak is None else peak / 1024**2
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def process_start_time():
+    """
+    Returns when this process was created, in seconds since the epoch, or None
+    when it cannot be read (e.g. on macOS). Timings from it include the
+    interpreter start-up and, in the packaged app, the PyInstaller bootloader.
+    """
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+            get_current_process.restype = wintypes.HANDLE
+            creation, exit, kernel, user = (wintypes.FILETIME() for _ in range(4))
+            if not ctypes.windll.kernel32.GetProcessTimes(get_current_process(), ctypes.byref(creation), ctypes.byref(exit),
+                                                          ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            # FILETIME counts 100 ns intervals since 1601-01-01
+            return ((creation.dwHighDateTime << 32) + creation.dwLowDateTime) / 10**7 - 11644473600
+
+        with open("/proc/self/stat") as f:
+            # Start time in clock ticks after boot, the 20th field after the command name
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + ticks / os.sysconf("SC_CLK_TCK")
+    except (AttributeError, OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def append_log(path, entry):
+    """
+    Appends entry as one JSON line to the log file at path. Logging never
+    stops the app, so a log that cannot be written is skipped.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+
+class StageProfiler:
+    """
+    Times pipeline stages and counts the samples and epochs they handle.
+
+    Stages can be nested, as when a streaming stage pulls blocks from the
+    stage before it. Each stage is only charged for its own time, excluding
+    the stages it calls. The peak RSS recorded for a stage is the process
+    peak when the stage last finished, so it includes earlier stages.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._child_seconds = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, samples=0, epochs=0):
+        start = time.perf_counter()
+        self._child_seconds.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            child_seconds = self._child_seconds.pop()
+            if self._child_seconds:
+                self._child_seconds[-1] += elapsed
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "samples": 0, "epochs": 0, "peak_rss_mb": None})
+            entry["seconds"] += elapsed - child_seconds
+            entry["calls"] += 1
+            self.count(name, samples=samples, epochs=epochs)
+            rss = peak_rss_mb()
+            if rss is not None:
+                entry["peak_rss_mb"] = max(entry["peak_rss_mb"] or 0, rss)
+
+    def count(self, name, samples=0, epochs=0):
+        entry = self.stages[name]
+        entry["samples"] += samples
+        entry["epochs"] += epochs
+
+    def iter_stage(self, name, iterable, samples=None, epochs=None):
+        """
+        Passes the items of iterable through, timing each step under name.
+
+        samples and epochs are optional callables returning the count held by an item.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.count(name, samples=samples(item) if samples else 0, epochs=epochs(item) if epochs else 0)
+            yield item
+
+    def report(self):
+        """
+        Returns the stage timings as a dictionary that can be written as JSON.
+        """
+        stages = {}
+        for name, entry in self.stages.items():
+            stages[name] = dict(entry, seconds=round(entry["seconds"], 4))
+            if entry["epochs"] and entry["seconds"] > 0:
+                stages[name]["epochs_per_second"] = round(entry["epochs"] / entry["seconds"], 1)
+            if entry["samples"] and entry["seconds"] > 0:
+                stages[name]["samples_per_second"] = round(entry["samples"] / entry["seconds"], 1)
+
+        return {"total_seconds": round(time.perf_counter() - self._start, 4), "peak_rss_mb": peak_rss_mb(), "stages": stages}
+
+
+def save_report(path, report):
+    # Written to a temporary file first so that readers never see a half-written report
+    with open(path + ".tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,138 @@
+import time
+
+
+def format_duration(seconds):
+    """
+    Returns a short human readable duration, e.g. "40 s", "12 min" or "3 h 05 min".
+    """
+    seconds = max(0, int(round(seconds)))
+    if seconds < 60:
+        return f"{seconds} s"
+    if seconds < 3600:
+        return f"{round(seconds / 60)} min"
+    return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+
+
+def _eta(elapsed, fraction):
+    # Time left at the average speed so far
+    return elapsed * (1 - fraction) / fraction
+
+
+class FileProgress:
+    """
+    Tracks how far one participant has got through its recording.
+
+    The samples of each streamed block and the epochs predicted are counted
+    as they pass, and at most every interval seconds report(status, fraction,
+    details) is called with details such as "40%, 350 epochs/s, about 2 min
+    left for this file". Stage changes are reported straight away, with
+    details None. Checking the interval is all that happens per block,
+    so it does not slow the processing down. Recordings read twice (nonwear
+    detection, then features) count as two passes.
+
+    Parameters:
+        - report: Callable receiving (status, fraction of the file done, details).
+        - passes: Number of times the recording is read.
+        - interval: Minimum seconds between throttled reports.
+    """
+
+    def __init__(self, report, passes=1, interval=1.0):
+        self.report = report
+        self.passes = passes
+        self.interval = interval
+        self.total_samples = None
+        self.samples = 0
+        self.epochs = 0
+        self._pass = 0
+        self._text = ""
+        self._start = time.perf_counter()
+        self._last_report = None
+
+    def fraction(self):
+        done = min(1.0, self.samples / self.total_samples) if self.total_samples else 0.0
+        return (self._pass + done) / self.passes
+
+    def status(self, text):
+        self._text = text
+        self.report(text, self.fraction(), None)
+
+    def set_total(self, samples):
+        self.total_samples = samples
+
+    def next_pass(self):
+        self._pass = min(self._pass + 1, self.passes - 1)
+        self.samples = 0
+        self.total_samples = None
+
+    def iter_blocks(self, blocks):
+        for block in blocks:
+            self.samples += len(block)
+            self.update()
+            yield block
+
+    def add_epochs(self, epochs):
+        self.epochs += epochs
+        self.update()
+
+    def finish(self):
+        self._pass = self.passes - 1
+        self.samples = self.total_samples = 1
+
+    def update(self):
+        now = time.perf_counter()
+        if self._last_report is not None and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+
+        fraction = self.fraction()
+        elapsed = now - self._start
+        # The size is unknown for features read back from the feature cache
+        details = [f"{fraction:.0%}"] if self.total_samples else []
+        if self.epochs and elapsed > 0:
+            details.append(f"{self.epochs / elapsed:,.0f} epochs/s")
+        if 0 < fraction < 1:
+            details.append(f"about {format_duration(_eta(elapsed, fraction))} left for this file")
+        self.report(self._text, fraction, ", ".join(details))
+
+
+class RunProgress:
+    """
+    Combines the progress of the participants of a run into one percentage,
+    and adds the time left for the whole run to their progress details.
+
+    Parameters:
+        - progress: Callable receiving (percent, status), as given to run_pipeline.
+        - n_files: Number of participants processed in this run.
+    """
+
+    def __init__(self, progress, n_files):
+        self.progress = progress
+        self.n_files = n_files
+        self.completed = 0
+        self.running = {}
+        self._done = set()
+        self._start = time.perf_counter()
+
+    def fraction(self):
+        return (self.completed + sum(self.running.values())) / max(self.n_files, 1)
+
+    def percent(self):
+        return round(self.fraction() * 100)
+
+    def update(self, key, status, fraction=None, details=None):
+        # Pool workers' messages can arrive after their participant was saved
+        if fraction is not None and key not in self._done:
+            self.running[key] = fraction
+
+        done = self.fraction()
+        if details:
+            if self.n_files > 1 and 0 < done < 1:
+                details += f", about {format_duration(_eta(time.perf_counter() - self._start, done))} left for all files"
+            status = f"{status.rstrip('.')} ({details})"
+        self.progress(round(done * 100), status)
+
+    def file_done(self, key, status):
+        self.running.pop(key, None)
+        self._done.add(key)
+        self.completed += 1
+        self.progress(self.percent(), status)
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+# Columns stored in RawSignal.values, in order
+signal_columns = ["X", "Y", "Z", "vector_magnitude"]
+
+
+class RawSignal:
+    """
+    Raw accelerometer samples held as a float32 (n, 4) array of X, Y, Z and
+    vector_magnitude.
+
+    Timestamps are not stored per sample. The samples are split into
+    segments recorded without gaps, and each segment keeps the offset of its
+    first sample and that sample's time, so any timestamp is derived from the
+    sample rate on demand. A recording without gaps is a single segment.
+    """
+
+    def __init__(self, values, start, hz, segment_offsets=None, segment_starts=None):
+        self.values = np.asarray(values, dtype=np.float32).reshape(-1, len(signal_columns))
+        self.hz = hz
+        if segment_offsets is None:
+            segment_offsets = [0]
+            segment_starts = [start]
+        self.segment_offsets = np.asarray(segment_offsets, dtype=np.int64)
+        self.segment_starts = np.asarray(segment_starts, dtype="datetime64[ns]")
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def start(self):
+        return self.timestamps([0])[0]
+
+    @classmethod
+    def from_timestamps(cls, values, timestamps, hz):
+        """
+        Builds a RawSignal from per-sample timestamps (datetime64 or seconds since the epoch).
+
+        A new segment starts wherever consecutive samples are not 1/hz apart.
+        """
+        timestamps = np.asarray(timestamps)
+        if timestamps.dtype.kind != "M":
+            timestamps = pd.to_datetime(timestamps, unit="s").to_numpy()
+        timestamps = timestamps.astype("datetime64[ns]")
+        if len(timestamps) == 0:
+            return cls(np.empty((0, len(signal_columns))), np.datetime64("NaT", "ns"), hz)
+
+        step = 1e9 / hz
+        gaps = np.abs(np.diff(timestamps).astype(np.int64) - step) > step / 2
+        segment_offsets = np.concatenate(([0], np.flatnonzero(gaps) + 1))
+        return cls(values, timestamps[0], hz, segment_offsets, timestamps[segment_offsets])
+
+    @classmethod
+    def from_dataframe(cls, df, hz):
+        return cls.from_timestamps(df[signal_columns].to_numpy(), df["Datetime"].to_numpy(), hz)
+
+    def timestamps(self, indices=None):
+        """
+        Returns the datetime64[ns] time of the given sample indices (all samples by default).
+        """
+        if indices is None:
+            indices = np.arange(len(self))
+        indices = np.asarray(indices, dtype=np.int64)
+        segment = np.searchsorted(self.segment_offsets, indices, side="right") - 1
+        offsets = np.round((indices - self.segment_offsets[segment]) * (1e9 / self.hz)).astype("timedelta64[ns]")
+        return self.segment_starts[segment] + offsets
+
+    def searchsorted(self, times, side="left"):
+        """
+        np.searchsorted over the derived timestamps, without materializing them.
+        """
+        times = np.asarray(times, dtype="datetime64[ns]")
+        step = 1e9 / self.hz
+        segment_lengths = np.diff(np.append(self.segment_offsets, len(self)))
+        segment = np.clip(np.searchsorted(self.segment_starts, times, side="right") - 1, 0, None)
+        delta = (times - self.segment_starts[segment]).astype(np.int64)
+        if side == "left":
+            position = np.ceil(delta / step)
+        else:
+            position = np.floor(delta / step) + 1
+        indices = self.segment_offsets[segment] + np.clip(position, 0, segment_lengths[segment]).astype(np.int64)
+        indices = np.clip(indices, 0, len(self))
+
+        # Correct for the rounding of derived timestamps to whole nanoseconds
+        if len(self):
+            before = indices > 0
+            previous = self.timestamps(np.maximum(indices - 1, 0))
+            indices -= before & ((previous >= times) if side == "left" else (previous > times))
+            after = indices < len(self)
+            current = self.timestamps(np.minimum(indices, len(self) - 1))
+            indices += after & ((current < times) if side == "left" else (current <= times))
+        return indices
+
+    def slice(self, start, stop):
+        # Samples start:stop as a new RawSignal sharing the same values buffer. The first
+        # segment keeps its original start time, with a negative offset when the slice
+        # begins inside it, so the derived timestamps are unchanged.
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        first = max(0, np.searchsorted(self.segment_offsets, start, side="right") - 1)
+        inner = (self.segment_offsets > start) & (self.segment_offsets < stop)
+        offsets = np.concatenate(([self.segment_offsets[first]], self.segment_offsets[inner])) - start
+        starts = np.concatenate(([self.segment_starts[first]], self.segment_starts[inner]))
+        return RawSignal(self.values[start:stop], None, self.hz, offsets, starts)
+
+    @staticmethod
+    def concatenate(signals):
+        """
+        Joins RawSignals end to end, merging segments that continue without a gap.
+        """
+        non_empty = [signal for signal in signals if len(signal)]
+        if not non_empty:
+            return signals[0].slice(0, 0)
+        if len(non_empty) == 1:
+            return non_empty[0]
+        signals = non_empty
+
+        hz = signals[0].hz
+        step = 1e9 / hz
+        offsets = []
+        starts = []
+        length = 0
+        signal_end = None
+        for signal in signals:
+            for segment, (offset, segment_start) in enumerate(zip(signal.segment_offsets, signal.segment_starts)):
+                if segment == 0:
+                    first_timestamp = signal.timestamps([0])[0]
+                    if signal_end is not None:
+                        # Merge with the previous signal when the samples continue without a gap
+                        expected = signal_end + np.timedelta64(int(round(step)), "ns")
+                        if abs((first_timestamp - expected).astype(np.int64)) <= step / 2:
+                            continue
+                    if offset < 0 and offsets:
+                        offset, segment_start = 0, first_timestamp
+                offsets.append(length + offset)
+                starts.append(segment_start)
+            length += len(signal)
+            signal_end = signal.timestamps([len(signal) - 1])[0]
+
+        return RawSignal(np.concatenate([signal.values for signal in signals]), None, hz, offsets, starts)
+
+    def to_dataframe(self):
+        df = pd.DataFrame(self.values[:, :3], columns=signal_columns[:3])
+        df["Datetime"] = self.timestamps()
+        df["vector_magnitude"] = self.values[:, 3]
+        return df
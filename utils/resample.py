@@ -0,0 +1,219 @@
+import math
+import numpy as np
+from utils.raw_signal import RawSignal
+
+def resample_ratio(hz, target_hz):
+    """
+    Returns (up, down) so that hz * up / down == target_hz.
+    """
+    divisor = math.gcd(int(hz), int(target_hz))
+    return int(target_hz) // divisor, int(hz) // divisor
+
+
+def resample_filter(up, down, half_taps=10, beta=5.0):
+    # Kaiser-windowed sinc low-pass, the same filter scipy.signal.resample_poly uses by default
+    max_rate = max(up, down)
+    half_len = half_taps * max_rate
+    cutoff = 1 / max_rate
+    h = cutoff * np.sinc(cutoff * np.arange(-half_len, half_len + 1)) * np.kaiser(2*half_len + 1, beta)
+    return h / h.sum() * up
+
+
+def output_length(n_samples, up, down):
+    return -(-n_samples * up // down)
+
+
+def polyphase_outputs(x, up, down, h, m_start, m_stop, x_offset=0, n_total=None):
+    """
+    Computes outputs m_start:m_stop of a polyphase resampling of one gap-free segment.
+
+    Output m is sum_i x[i] * h[m*down + half_len - i*up], which equals
+    scipy.signal.resample_poly(segment, up, down, axis=0)[m]. Only the input
+    samples around the requested outputs are needed, so long recordings can
+    be resampled block by block with the same result.
+
+    Parameters:
+        - x: Array (n, channels) with samples x_offset:x_offset+n of the segment.
+        - up, down, h: Resampling ratio and filter from resample_filter.
+        - m_start, m_stop: Range of outputs to compute.
+        - x_offset: Index of x[0] within the segment.
+        - n_total: Length of the whole segment. Samples outside it count as zero.
+    """
+    n_total = x_offset + len(x) if n_total is None else n_total
+    half_len = (len(h) - 1) // 2
+    taps = -(-len(h) // up)
+    padded_h = np.zeros(taps * up)
+    padded_h[:len(h)] = h
+    phases = padded_h.reshape(taps, up).T  # phases[r, t] == h[r + t*up]
+
+    n_out = max(0, m_stop - m_start)
+    channels = x.shape[1]
+    if n_out == 0:
+        return np.empty((0, channels))
+
+    # Inputs the outputs depend on, with zeros outside the segment
+    first = (m_start * down + half_len) // up - taps + 1
+    last = ((m_stop - 1) * down + half_len) // up
+    padded = np.zeros((last - first + 1, channels))
+    lo = max(first, 0, x_offset)
+    hi = min(last + 1, n_total, x_offset + len(x))
+    if hi > lo:
+        padded[lo - first:hi - first] = x[lo - x_offset:hi - x_offset]
+
+    # Outputs p, p+up, p+2*up... share a filter phase and step through the input by down
+    y = np.empty((n_out, channels))
+    for p in range(min(up, n_out)):
+        position = (m_start + p) * down + half_len
+        last_input = position // up
+        phase = phases[position - last_input * up]
+        count = len(range(p, n_out, up))
+        total = np.zeros((count, channels))
+        for t in np.flatnonzero(phase):
+            start = last_input - t - first
+            total += phase[t] * padded[start:start + (count - 1) * down + 1:down]
+        y[p::up] = total
+
+    return y
+
+
+def input_range(m_start, m_stop, up, down, h, n_total):
+    """
+    Returns the slice of segment samples that outputs m_start:m_stop depend on.
+    """
+    half_len = (len(h) - 1) // 2
+    taps = -(-len(h) // up)
+    first = (m_start * down + half_len) // up - taps + 1
+    last = ((m_stop - 1) * down + half_len) // up
+    return max(0, first), min(n_total, last + 1)
+
+
+def _signal_from_xyz(xyz, segment_start, first_output, target_hz):
+    # RawSignal of resampled outputs first_output... of a segment starting at segment_start
+    values = np.empty((len(xyz), 4), dtype=np.float32)
+    values[:, :3] = xyz
+    values[:, 3] = np.sqrt((values[:, :3]**2).sum(axis=1))
+    return RawSignal(values, None, target_hz, [-first_output], [segment_start])
+
+
+def resample_segment_blocks(read_xyz, segment_starts, segment_lengths, hz, target_hz, block_size):
+    """
+    Yields the resampled recording as RawSignals of block_size outputs at target_hz.
+
+    Each gap-free segment is resampled on its own, so gaps stay gaps.
+
+    Parameters:
+        - read_xyz: Callable (segment, start, stop) returning the float X, Y, Z
+          samples start:stop of a segment.
+        - segment_starts: datetime64[ns] start of each segment.
+        - segment_lengths: Number of input samples in each segment.
+        - hz, target_hz: Input and output sampling frequencies.
+        - block_size: Number of output samples per block.
+    """
+    up, down = resample_ratio(hz, target_hz)
+    h = resample_filter(up, down)
+    out_lengths = np.array([output_length(n, up, down) for n in segment_lengths], dtype=np.int64)
+    out_offsets = np.concatenate(([0], np.cumsum(out_lengths)))
+
+    for block_start in range(0, int(out_offsets[-1]), block_size):
+        block_stop = min(block_start + block_size, int(out_offsets[-1]))
+        pieces = []
+        first_segment = np.searchsorted(out_offsets, block_start, side="right") - 1
+        for segment in range(first_segment, len(segment_lengths)):
+            if out_offsets[segment] >= block_stop:
+                break
+            m_start = max(block_start, out_offsets[segment]) - out_offsets[segment]
+            m_stop = min(block_stop, out_offsets[segment + 1]) - out_offsets[segment]
+            if m_stop <= m_start:
+                continue
+            x_start, x_stop = input_range(m_start, m_stop, up, down, h, segment_lengths[segment])
+            x = np.asarray(read_xyz(segment, x_start, x_stop), dtype=np.float64)
+            xyz = polyphase_outputs(x, up, down, h, m_start, m_stop, x_offset=x_start, n_total=segment_lengths[segment])
+            pieces.append(_signal_from_xyz(xyz, segment_starts[segment], m_start, target_hz))
+
+        yield RawSignal.concatenate(pieces)
+
+
+def resample_stream_blocks(pieces, hz, target_hz, block_size):
+    """
+    Yields the resampled recording as RawSignals of block_size outputs at
+    target_hz, from its samples in reading order.
+
+    The outputs are the same as those of resample_segment_blocks, but the
+    segment lengths need not be known in advance: each output is computed
+    as soon as the input samples it depends on have been read, and only the
+    samples still needed by later outputs are kept.
+
+    Parameters:
+        - pieces: Iterable of (start, xyz) with the float X, Y, Z samples in
+          order. start is the datetime64[ns] time of the first sample when the
+          piece starts a new gap-free segment, and None when it continues the
+          previous one.
+        - hz, target_hz: Input and output sampling frequencies.
+        - block_size: Number of output samples per block.
+    """
+    up, down = resample_ratio(hz, target_hz)
+    h = resample_filter(up, down)
+    half_len = (len(h) - 1) // 2
+    taps = -(-len(h) // up)
+
+    pending = []  # Resampled outputs not yet yielded
+    n_pending = 0
+    segment_start = None
+    x = np.empty((0, 3))
+    x_offset = 0  # Index of x[0] within the segment
+    m_done = 0  # Outputs of the segment computed so far
+
+    def resample(m_stop, n_total=None):
+        nonlocal x, x_offset, m_done, n_pending
+        if m_stop > m_done:
+            xyz = polyphase_outputs(x, up, down, h, m_done, m_stop, x_offset=x_offset, n_total=n_total)
+            pending.append(_signal_from_xyz(xyz, segment_start, m_done, target_hz))
+            n_pending += len(xyz)
+            m_done = m_stop
+        # Drop the samples that no later output depends on
+        first = max(0, (m_done * down + half_len) // up - taps + 1)
+        if first > x_offset:
+            x = x[first - x_offset:]
+            x_offset = first
+
+    def full_blocks(final=False):
+        nonlocal pending, n_pending
+        while n_pending >= block_size or (final and n_pending):
+            signal = RawSignal.concatenate(pending)
+            size = min(block_size, n_pending)
+            pending = [signal.slice(size, len(signal))] if len(signal) > size else []
+            n_pending = len(signal) - size
+            yield signal.slice(0, size)
+
+    for start, xyz in pieces:
+        if start is not None:
+            if segment_start is not None:
+                n_total = x_offset + len(x)
+                resample(output_length(n_total, up, down), n_total)
+            segment_start, x, x_offset, m_done = start, np.empty((0, 3)), 0, 0
+        x = np.concatenate((x, np.asarray(xyz, dtype=np.float64)))
+
+        # Outputs whose last input sample has been read
+        n_read = x_offset + len(x)
+        resample(max(m_done, (n_read * up - half_len - 1) // down + 1))
+        yield from full_blocks()
+
+    if segment_start is not None:
+        n_total = x_offset + len(x)
+        resample(output_length(n_total, up, down), n_total)
+    yield from full_blocks(final=True)
+
+
+def resample_signal(signal, target_hz):
+    """
+    Resamples a RawSignal to target_hz, one gap-free segment at a time.
+    """
+    if signal.hz == target_hz:
+        return signal
+
+    offsets = np.append(np.maximum(signal.segment_offsets, 0), len(signal))
+    starts = signal.timestamps(offsets[:-1]) if len(signal) else signal.segment_starts
+    lengths = np.diff(offsets)
+    read_xyz = lambda segment, start, stop: signal.values[offsets[segment] + start:offsets[segment] + stop, :3]
+    blocks = list(resample_segment_blocks(read_xyz, starts, lengths, signal.hz, target_hz, block_size=max(1, sum(lengths) * target_hz)))
+    return RawSignal.concatenate(blocks) if blocks else RawSignal(np.empty((0, 4)), np.datetime64("NaT", "ns"), target_hz)
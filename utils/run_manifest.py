@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+from utils.feature_cache import hash_file, feature_engine_version
+
+manifest_filename = "run_manifest.json"
+checkpoint_filename = "run_checkpoint.json"
+
+
+def load_manifest(output_folder):
+    manifest_path = os.path.join(output_folder, manifest_filename)
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _save_json(json_path, data):
+    # Written to a temporary file first so an interrupted run never leaves a truncated file
+    with open(json_path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(json_path + ".tmp", json_path)
+
+
+def save_manifest(output_folder, manifest):
+    _save_json(os.path.join(output_folder, manifest_filename), manifest)
+
+
+def load_checkpoint(output_folder):
+    """
+    Returns the checkpoint of a run into output_folder that did not finish
+    (cancelled, crashed or lost power), or None.
+
+    The checkpoint lists the studyids that run still had to process under
+    "pending". Participants it finished are in the run manifest, so a new run
+    with the same settings can skip them and resume at the first unfinished one.
+    """
+    checkpoint_path = os.path.join(output_folder, checkpoint_filename)
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(output_folder, pending):
+    _save_json(os.path.join(output_folder, checkpoint_filename), {"pending": sorted(pending)})
+
+
+def remove_checkpoint(output_folder):
+    checkpoint_path = os.path.join(output_folder, checkpoint_filename)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def participant_fingerprint(file_path, selectedData, wear_time_df, previous=None):
+    """
+    Describes everything a participant's outputs depend on.
+
+    Parameters:
+        - file_path: Path to the .gt3x file.
+        - selectedData: Dictionary with the user selections.
+        - wear_time_df: The participant's logbook rows, or None.
+        - previous: The participant's entry from the last run's manifest. Its
+          file hash is reused when the file's size and mtime have not changed.
+
+    Returns:
+        - Dictionary that can be stored in the manifest and compared with ==.
+    """
+    stat = os.stat(file_path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+        sha256 = previous["sha256"]
+    else:
+        sha256 = hash_file(file_path)
+
+    if wear_time_df is None:
+        logbook_rows = None
+    else:
+        logbook_rows = hashlib.sha256(wear_time_df.to_csv(index=False).encode()).hexdigest()
+
+    return {
+        "file": os.path.basename(file_path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": sha256,
+        "logbook_rows": logbook_rows,
+        "outcome": selectedData["outcome"],
+        "non_wear_method": selectedData["non_wear_method"],
+        "hop_seconds": selectedData.get("hop_seconds"),
+        "bouts": [selectedData.get("bout_minutes"), selectedData.get("bout_tolerance_minutes"), selectedData.get("bout_min_share")] if selectedData.get("bout_summary") else None,
+        "hourly_summary": bool(selectedData.get("hourly_summary")),
+        "weekday_summary": bool(selectedData.get("weekday_summary")),
+        "output_format": selectedData.get("output_format", "csv"),
+        "save_predictions": selectedData.get("save_predictions", True),
+        "slim_predictions": selectedData.get("slim_predictions", False),
+        "save_trimmed_data": selectedData.get("save_trimmed_data", True),
+        "feature_engine_version": feature_engine_version,
+    }
+
+
+def is_unchanged(previous, fingerprint):
+    # mtime alone changing (e.g. a copied folder) does not force a re-run
+    ignored = ("mtime",)
+    return previous is not None and all(previous.get(key) == value for key, value in fingerprint.items() if key not in ignored)
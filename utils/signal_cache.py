@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import contextlib
+import numpy as np
+from utils.raw_signal import RawSignal, signal_columns
+from utils.feature_cache import hash_file
+from utils.config import default_signal_cache_folder
+
+# Bump when the loader changes the decoded values (e.g. the resampling filter)
+signal_cache_version = 1
+
+
+class SignalCache:
+    """
+    On-disk cache of decoded recordings, opened with np.memmap.
+
+    Each entry is a .bin file with the float32 (n, 4) RawSignal values and a
+    .json header with the sample rate, length and segments, named by a hash
+    of the .gt3x contents and the sample rate the recording was loaded at.
+    Cached recordings skip GT3X decoding, and blocks are views of the mapped
+    file, so the pages are read on demand and shared by every process
+    reading the same entry. When the folder grows past max_bytes the least
+    recently used entries are deleted.
+    """
+
+    def __init__(self, cache_folder=default_signal_cache_folder, max_bytes=20 * 1024**3):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def key(self, file_path, hz=None):
+        settings = {"file": hash_file(file_path), "hz": hz, "version": signal_cache_version}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_folder, key)
+        return base + ".bin", base + ".json"
+
+    def load(self, key):
+        """
+        Returns the cached recording as a RawSignal backed by a read-only
+        memory map, or None when it is not cached.
+        """
+        values_path, header_path = self._paths(key)
+        if not (os.path.exists(values_path) and os.path.exists(header_path)):
+            return None
+
+        try:
+            with open(header_path) as f:
+                header = json.load(f)
+            values = np.memmap(values_path, dtype="<f4", mode="r", shape=(header["length"], len(signal_columns))) \
+                if header["length"] else np.empty((0, len(signal_columns)), dtype=np.float32)
+        except (OSError, ValueError, KeyError):
+            # Unreadable or truncated entries are treated as misses
+            self._remove(key)
+            return None
+
+        os.utime(values_path)  # Mark as recently used
+        return RawSignal(values, None, header["hz"], header["segment_offsets"],
+                         np.array(header["segment_starts"], dtype=np.int64).astype("datetime64[ns]"))
+
+    def store_blocks(self, key, blocks):
+        """
+        Passes RawSignal blocks through, writing their values to the cache as
+        they go. The entry only becomes visible once the stream ends.
+        """
+        values_path, header_path = self._paths(key)
+        tmp_path = values_path + ".tmp"
+        offsets = []
+        starts = []
+        length = 0
+        hz = None
+        end = None
+        completed = False
+        try:
+            with open(tmp_path, "wb") as f:
+                for block in blocks:
+                    if len(block):
+                        hz = block.hz
+                        step = 1e9 / hz
+                        block_offsets = np.maximum(block.segment_offsets, 0)
+                        first = block.timestamps([0])[0]
+                        # A first segment continuing the previous block is not a new segment
+                        skip = int(end is not None and abs((first - end).astype(np.int64) - step) <= step / 2)
+                        offsets.extend((length + block_offsets[skip:]).tolist())
+                        starts.extend(block.timestamps(block_offsets[skip:]).astype(np.int64).tolist())
+                        end = block.timestamps([len(block) - 1])[0]
+                        length += len(block)
+                        f.write(np.ascontiguousarray(block.values, dtype="<f4").tobytes())
+                    yield block
+            completed = True
+        finally:
+            if not completed or hz is None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+
+        if hz is None:
+            return
+        os.replace(tmp_path, values_path)
+        header = {"hz": hz, "length": length, "segment_offsets": offsets, "segment_starts": starts,
+                  "columns": signal_columns, "version": signal_cache_version}
+        with open(header_path + ".tmp", "w") as f:
+            json.dump(header, f)
+        os.replace(header_path + ".tmp", header_path)
+        self._evict()
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def _evict(self):
+        entries = []
+        for filename in os.listdir(self.cache_folder):
+            if filename.endswith(".bin"):
+                with contextlib.suppress(OSError):
+                    stat = os.stat(os.path.join(self.cache_folder, filename))
+                    entries.append((stat.st_mtime, stat.st_size, filename[:-len(".bin")]))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+
@@ -1,11 +1,232 @@
 import os
+import numpy as np
 import pandas as pd
+from utils.writers import write_csv
+from utils.config import bout_labels as default_bout_labels, bout_minutes as default_bout_minutes, bout_tolerance_minutes, bout_min_share
 
-def summarize_predictions(prediction_data, epoch=5):
-    prediction_data['Date'] = prediction_data['Time'].dt.date
-    df = prediction_data.groupby(["Date", "Prediction"])['Prediction'].count().mul(epoch).div(60).reset_index(name='Min')
 
-    return df.pivot(index='Date', columns='Prediction', values='Min')
+def count_predictions(prediction_data, classes=None):
+    """
+    Counts the epochs of each label per day and hour in a single pass.
+
+    Days and labels are turned into integer codes and counted with bincount,
+    so the hourly, daily and weekday/weekend summaries below are all built
+    from this result without going over the predictions again.
+
+    Parameters:
+        - prediction_data: DataFrame with Time and Prediction columns.
+        - classes: Optional list of all labels, so that every label gets a
+          column even when it was never predicted. Defaults to the labels present.
+
+    Returns:
+        - first_day: datetime64[D] of the first day.
+        - counts: Integer array of shape (days, 24, labels).
+        - labels: Sorted label names matching the last axis of counts.
+    """
+    times = prediction_data['Time'].to_numpy(dtype="datetime64[ns]")
+    predictions = prediction_data['Prediction'].to_numpy()
+
+    if classes is None:
+        labels, label_codes = np.unique(predictions, return_inverse=True)
+    else:
+        labels = np.sort(np.asarray(classes))
+        label_codes = np.searchsorted(labels, predictions)
+
+    if len(times) == 0:
+        return np.datetime64("NaT", "D"), np.zeros((0, 24, len(labels)), dtype=np.int64), labels
+
+    hours = times.astype("datetime64[h]").astype(np.int64)
+    first_day = times.min().astype("datetime64[D]")
+    hour_codes = hours - first_day.astype("datetime64[h]").astype(np.int64)
+    n_days = hour_codes.max() // 24 + 1
+
+    counts = np.bincount(hour_codes * len(labels) + label_codes, minlength=n_days * 24 * len(labels))
+    return first_day, counts.reshape(n_days, 24, len(labels)), labels
+
+
+def _minutes(counts, epoch):
+    # Minutes per label, with NaN where a label was never predicted (as a pivot would give)
+    minutes = counts * epoch / 60
+    return np.where(counts > 0, minutes, np.nan)
+
+
+def daily_summary(first_day, counts, labels, epoch=5):
+    """
+    Returns the minutes of each label per day, indexed by Date.
+    """
+    day_counts = counts.sum(axis=1)
+    days = np.flatnonzero(day_counts.sum(axis=1) > 0)
+    dates = pd.Index((first_day + days).astype(object), name='Date')
+    return pd.DataFrame(_minutes(day_counts[days], epoch), index=dates, columns=pd.Index(labels, name='Prediction'))
+
+
+def hourly_summary(first_day, counts, labels, epoch=5):
+    """
+    Returns the minutes of each label per hour, with Date and Hour columns.
+    """
+    days, hours = np.nonzero(counts.sum(axis=2) > 0)
+    summary = pd.DataFrame(_minutes(counts[days, hours], epoch), columns=pd.Index(labels, name='Prediction'))
+    summary.insert(0, 'Date', (first_day + days).astype(object))
+    summary.insert(1, 'Hour', hours)
+    return summary
+
+
+def weekday_summary(first_day, counts, labels, epoch=5):
+    """
+    Returns the average minutes per day of each label on weekdays and on
+    weekend days, with the number of days each average is based on.
+    """
+    day_counts = counts.sum(axis=1)
+    days = np.flatnonzero(day_counts.sum(axis=1) > 0)
+    # datetime64[D] day 0 (1970-01-01) was a Thursday, so Monday is 0 after shifting by 3
+    weekend = ((first_day + days).astype(np.int64) + 3) % 7 >= 5
+
+    rows = []
+    for day_type, selected in (("weekday", ~weekend), ("weekend", weekend)):
+        n_days = int(selected.sum())
+        if n_days:
+            minutes = day_counts[days[selected]].sum(axis=0) * epoch / 60 / n_days
+            rows.append([day_type, n_days] + minutes.tolist())
+
+    return pd.DataFrame(rows, columns=['DayType', 'Days'] + list(labels))
+
+
+def label_runs(positions, inside):
+    """
+    Run-length encodes a boolean series of predictions.
+
+    A run ends where the value changes or where the predictions are not
+    consecutive (a gap or removed nonwear period).
+
+    Parameters:
+        - positions: Sorted integer epoch number of each prediction.
+        - inside: Boolean array, e.g. whether each prediction is sedentary.
+
+    Returns:
+        - starts, stops: Index of the first and one past the last prediction of each run.
+        - values: The value of inside in each run.
+    """
+    if len(positions) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=bool)
+
+    boundaries = np.flatnonzero((inside[1:] != inside[:-1]) | (np.diff(positions) != 1)) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(positions)]))
+    return starts, stops, inside[starts]
+
+
+def find_bouts(positions, inside, tolerance_epochs=0, min_share=0):
+    """
+    Returns the bouts of a boolean series of predictions.
+
+    A bout is a run of inside predictions, joined with the next run when the
+    predictions between them are consecutive and at most tolerance_epochs
+    long, and when at least min_share of the joined bout's epochs are inside.
+    Runs are joined from the start of the recording onwards. Bouts start and
+    end with an inside prediction and never span a gap.
+
+    Returns:
+        - starts, stops: Index of the first and last prediction of each bout.
+        - lengths: Number of epochs from the first to the last prediction, interruptions included.
+    """
+    starts, stops, values = label_runs(positions, inside)
+    starts, stops = starts[values], stops[values] - 1
+
+    # Runs separated only by a short uninterrupted stretch of other predictions can be one bout
+    interruption = positions[starts[1:]] - positions[stops[:-1]] - 1
+    joinable = (interruption <= tolerance_epochs) & (interruption == starts[1:] - stops[:-1] - 1)
+    joined = np.zeros(len(joinable), dtype=bool)
+    if joinable.any():
+        # The share of inside epochs depends on the runs joined before, so candidates are checked in order
+        run_epochs = stops - starts + 1
+        bout_start, bout_inside = positions[starts[0]], run_epochs[0]
+        for run in range(1, len(starts)):
+            if joinable[run - 1] and bout_inside + run_epochs[run] >= min_share * (positions[stops[run]] - bout_start + 1):
+                joined[run - 1] = True
+                bout_inside += run_epochs[run]
+            else:
+                bout_start, bout_inside = positions[starts[run]], run_epochs[run]
+
+    first = np.concatenate(([True], ~joined))
+    last = np.concatenate((~joined, [True]))
+    starts, stops = starts[first], stops[last]
+    return starts, stops, positions[stops] - positions[starts] + 1
+
+
+def bout_summary(prediction_data, classes=None, epoch=5, bout_labels=default_bout_labels, bout_minutes=default_bout_minutes,
+                 tolerance_minutes=bout_tolerance_minutes, min_share=bout_min_share):
+    """
+    Returns the activity bouts, sedentary breaks and transitions per day.
+
+    Computed with vectorized run-length encoding of the predictions. For
+    each bout type whose labels the model predicts there are three columns:
+    the number of bouts of at least bout_minutes ({type}_bouts), the minutes
+    in those bouts ({type}_bout_minutes) and the longest bout of any length
+    ({type}_longest_bout, in minutes). Bouts may contain interruptions of up
+    to tolerance_minutes as long as at least min_share of their epochs have
+    the bout type's labels, and are counted on the day they start.
+    SED_breaks counts the changes from a sedentary to a non-sedentary
+    prediction, and Transitions every change of label between consecutive
+    predictions.
+
+    Parameters:
+        - prediction_data: DataFrame with Time and Prediction columns.
+        - classes: Optional list of all labels of the model. Defaults to the labels present.
+        - epoch: Seconds each prediction stands for.
+        - bout_labels: Dictionary of bout type to the labels it counts. The
+          "SED" type also defines the sedentary breaks.
+        - bout_minutes, tolerance_minutes, min_share: Shortest bout, longest
+          interruption within a bout and share of a bout's epochs with its
+          labels (defaults in utils.config).
+
+    Returns:
+        - DataFrame with a Date column and one row per day with predictions.
+    """
+    times = prediction_data['Time'].to_numpy(dtype="datetime64[ns]")
+    predictions = prediction_data['Prediction'].to_numpy()
+    if len(times) > 1 and (np.diff(times) < np.timedelta64(0)).any():
+        order = np.argsort(times, kind="stable")
+        times, predictions = times[order], predictions[order]
+
+    present = set(np.unique(predictions)) if classes is None else set(classes)
+    types = {name: labels for name, labels in bout_labels.items() if present & set(labels)}
+    columns = ['Date', 'Transitions'] + (['SED_breaks'] if "SED" in types else [])
+    columns += [f"{name}_{column}" for name in types for column in ("bouts", "bout_minutes", "longest_bout")]
+    if len(times) == 0:
+        return pd.DataFrame(columns=columns)
+
+    positions = (times - times[0]).astype(np.int64) // int(round(epoch * 1e9))
+    day_codes = (times.astype("datetime64[D]") - times[0].astype("datetime64[D]")).astype(np.int64)
+    n_days = day_codes[-1] + 1
+    consecutive = np.diff(positions) == 1
+
+    counts = {'Transitions': np.bincount(day_codes[1:][consecutive & (predictions[1:] != predictions[:-1])], minlength=n_days)}
+    if "SED" in types:
+        sedentary = np.isin(predictions, types["SED"])
+        counts['SED_breaks'] = np.bincount(day_codes[1:][consecutive & sedentary[:-1] & ~sedentary[1:]], minlength=n_days)
+
+    min_epochs = int(np.ceil(bout_minutes * 60 / epoch))
+    tolerance_epochs = int(tolerance_minutes * 60 // epoch)
+    for name, labels in types.items():
+        starts, _, lengths = find_bouts(positions, np.isin(predictions, labels), tolerance_epochs, min_share)
+        bout_days = day_codes[starts]
+        bouts = lengths >= min_epochs
+        longest = np.zeros(n_days, dtype=np.int64)
+        np.maximum.at(longest, bout_days, lengths)
+        counts[f"{name}_bouts"] = np.bincount(bout_days[bouts], minlength=n_days)
+        counts[f"{name}_bout_minutes"] = np.bincount(bout_days[bouts], weights=lengths[bouts], minlength=n_days) * epoch / 60
+        counts[f"{name}_longest_bout"] = longest * epoch / 60
+
+    days = np.unique(day_codes)
+    summary = pd.DataFrame({column: values[days] for column, values in counts.items()}, columns=columns[1:])
+    summary.insert(0, 'Date', (times[0].astype("datetime64[D]") + days).astype(object))
+    return summary
+
+
+def summarize_predictions(prediction_data, epoch=5, classes=None):
+    first_day, counts, labels = count_predictions(prediction_data, classes)
+    return daily_summary(first_day, counts, labels, epoch)
 
 
 def merge_summary_files(output_folder):
@@ -23,4 +244,4 @@ def merge_summary_files(output_folder):
         final_summary = pd.merge(wear_summary, by_day_summary, on=['studyid', 'Date'], how='outer')
         
         # Save the final merged summary
-        final_summary.to_csv(final_summary_path, index=False)
\ No newline at end of file
+        write_csv(final_summary_path, final_summary)
@@ -0,0 +1,120 @@
+import os
+import csv
+import contextlib
+
+# File extension for each output format
+output_formats = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
+class TableWriter:
+    """
+    Streams DataFrame blocks with the same columns into one CSV, Parquet or
+    Feather file.
+
+    CSV blocks are appended to the file. Parquet blocks become row groups and
+    Feather blocks record batches, both zstd-compressed, so the whole table is
+    never held in memory. Parquet and Feather need pyarrow. Blocks are
+    written to a temporary file next to the output, which only replaces the
+    output (or a file left by an earlier run) on close, so an interrupted run
+    never leaves a partial file behind. discard() drops the temporary file.
+    When nothing was written, close() leaves an earlier file as it is.
+    """
+
+    def __init__(self, path_without_extension, output_format="csv", index=False):
+        if output_format not in output_formats:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.path = path_without_extension + output_formats[output_format]
+        self.tmp_path = self.path + ".tmp"
+        self.output_format = output_format
+        self.index = index
+        self._writer = None
+        self._schema = None
+
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def write(self, df):
+        if self.output_format == "csv":
+            df.to_csv(self.tmp_path, mode='a', header=not os.path.exists(self.tmp_path), index=self.index)
+            return
+
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("Parquet and Feather output need pyarrow (pip install pyarrow)") from None
+
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=self.index)
+            self._schema = table.schema
+            if self.output_format == "parquet":
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.tmp_path, self._schema, compression="zstd")
+            else:
+                import pyarrow.ipc as ipc
+                self._writer = ipc.new_file(self.tmp_path, self._schema, options=ipc.IpcWriteOptions(compression="zstd"))
+        else:
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=self.index)
+
+        self._writer.write_table(table)
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        self._close_writer()
+        if os.path.exists(self.tmp_path):
+            os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self._close_writer()
+        with contextlib.suppress(OSError):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def append_csv(csv_path, df, index=False):
+    """
+    Appends rows to a CSV shared by all participants, writing the header when
+    the file is new.
+
+    The rows are appended in place and flushed to disk. A crash while
+    appending can leave a cut-off last line; the pipeline's run checkpoint
+    makes the next run remove the unfinished participant's rows, and with
+    them that line (see utils.pipeline.remove_participant_rows).
+
+    When the columns differ from the file's header (e.g. a re-run with
+    another outcome model), the file is rewritten with the columns of both,
+    leaving the cells of the missing columns empty.
+    """
+    header = not os.path.exists(csv_path)
+    if not header:
+        with open(csv_path, newline="") as f:
+            existing_columns = next(csv.reader(f), [])
+        rows = df.reset_index() if index else df
+        if existing_columns != [str(column) for column in rows.columns]:
+            import pandas as pd
+            # Earlier rows are read as text so that they are written back unchanged
+            existing = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+            write_csv(csv_path, pd.concat([existing, rows], ignore_index=True))
+            return
+
+    with open(csv_path, "a", newline="") as f:
+        df.to_csv(f, header=header, index=index)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_csv(csv_path, df, index=False):
+    # Whole-file counterpart of append_csv
+    df.to_csv(csv_path + ".tmp", index=index)
+    os.replace(csv_path + ".tmp", csv_path)